@@ -0,0 +1,128 @@
+# Animation system advancing every Animator of a world in one batched pass per
+# tick. Rather than each Animator reading the clock and computing its frame
+# interval on every update, the clock is read once per tick, intervals are
+# computed once per sequence, and per-entity state lives in NumPy arrays
+# indexed by the Animator's slot:
+#
+#   sequence_ids  Sequence playing, an index into sequences
+#   frames        Frame within the sequence
+#   last_change   Game time of the last change of frame
+#   finished      Whether a non-looping sequence played to its end
+#   enabled       Whether the Animator's entity is in play
+#   clocks        World the Animator's entity belongs to, an index into worlds
+#
+# Sequences themselves are shared, immutable, and registered once per world.
+# When a non-looping sequence finishes, the Animator notifies its listeners,
+# so no component has to poll for it every tick.
+#
+# Several worlds may share one system, as they do in vecenv.VectorEnv, so
+# their Animators are all advanced in a single pass. Each world keeps its own
+# game time, so update_worlds() reads the time of every world and each
+# Animator is advanced by the time of its own.
+
+from typing import Dict, List, TYPE_CHECKING, Union
+import numpy as np
+from assets import Sequence
+
+if TYPE_CHECKING:
+    import components
+    from world import World
+
+
+class AnimationSystem:
+    def __init__(self, capacity: int = 64) -> None:
+        self.sequences: List[Sequence] = []
+        self.sequence_index: Dict[Sequence, int] = {}
+
+        # Per sequence, precomputed from the sequence when registered.
+        self.intervals = np.zeros(0, dtype=np.float64)
+        self.lengths = np.zeros(0, dtype=np.int64)
+        self.loops = np.zeros(0, dtype=np.bool_)
+
+        # Per Animator.
+        self.animators: List["components.Animator"] = []
+        self.sequence_ids = np.zeros(capacity, dtype=np.int64)
+        self.frames = np.zeros(capacity, dtype=np.int64)
+        self.last_change = np.zeros(capacity, dtype=np.float64)
+        self.finished = np.zeros(capacity, dtype=np.bool_)
+        self.enabled = np.zeros(capacity, dtype=np.bool_)
+        self.clocks = np.zeros(capacity, dtype=np.int64)
+
+        # Worlds with Animators registered, in order of their first one.
+        self.worlds: Dict["World", int] = {}
+
+    def register_sequence(self, sequence: Sequence) -> int:
+        id_ = self.sequence_index.get(sequence)
+        if id_ is None:
+            id_ = len(self.sequences)
+            self.sequences.append(sequence)
+            self.sequence_index[sequence] = id_
+            self.intervals = np.append(self.intervals,
+                                       1000.0 / sequence.sample_rate)
+            self.lengths = np.append(self.lengths, len(sequence.frames))
+            self.loops = np.append(self.loops, sequence.loop)
+        return id_
+
+    def register_animator(self, animator: "components.Animator") -> int:
+        slot = len(self.animators)
+        if slot == len(self.frames):
+            # Double capacity to get amortized O(1) registration.
+            capacity = 2 * slot
+            self.sequence_ids = np.resize(self.sequence_ids, capacity)
+            self.frames = np.resize(self.frames, capacity)
+            self.last_change = np.resize(self.last_change, capacity)
+            self.finished = np.resize(self.finished, capacity)
+            self.enabled = np.resize(self.enabled, capacity)
+            self.clocks = np.resize(self.clocks, capacity)
+            for array in (self.sequence_ids, self.frames, self.last_change,
+                          self.finished, self.enabled, self.clocks):
+                array[slot:] = 0
+        world = animator.container.world
+        self.clocks[slot] = self.worlds.setdefault(world, len(self.worlds))
+        self.animators.append(animator)
+        return slot
+
+    def play(self, slot: int, sequence_id: int, now: float) -> None:
+        """Starts playing a sequence from its first frame."""
+        self.sequence_ids[slot] = sequence_id
+        self.frames[slot] = 0
+        self.finished[slot] = False
+        self.last_change[slot] = now
+
+    def update_worlds(self) -> None:
+        """Advances the Animators of every world sharing the system, each by
+        the game time of its world."""
+        self.update(np.array([world.time_ms for world in self.worlds]))
+
+    def update(self, now: Union[float, np.ndarray]) -> None:
+        """Advances every enabled Animator whose next frame is due by one
+        frame. now is the game time, or the game time of each world in order
+        of self.worlds."""
+        n = len(self.animators)
+        if isinstance(now, np.ndarray):
+            now = now[self.clocks[:n]]
+        # Comparing elapsed time, rather than now against a precomputed time of
+        # next change, keeps frames changing on exactly the same ticks as
+        # before animation was batched, as floating-point rounding differs.
+        elapsed = now - self.last_change[:n]
+        due = np.flatnonzero(self.enabled[:n] & (
+            elapsed >= self.intervals[self.sequence_ids[:n]]))
+        if len(due) == 0:
+            return
+
+        sequence_ids = self.sequence_ids[due]
+        frames = self.frames[due]
+        loops = self.loops[sequence_ids]
+        at_end = frames == self.lengths[sequence_ids] - 1
+        self.frames[due] = np.where(at_end, np.where(loops, 0, frames),
+                                    frames + 1)
+        finished = at_end & ~loops
+        newly_finished = due[finished & ~self.finished[due]]
+        self.finished[due] = finished
+        self.last_change[due] = now[due] if isinstance(now, np.ndarray) \
+            else now
+
+        # Listeners may take the entity out of play, which disables its
+        # Animator, so they're notified once the arrays are up to date.
+        for slot in newly_finished.tolist():
+            self.animators[slot].notify_finished()
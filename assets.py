@@ -0,0 +1,214 @@
+# Caches for assets shared among entities. Without them every enemy would load
+# its own copy of each animation frame from disk and upload it to the GPU, so
+# startup time and VRAM use would grow with the number of entities rather than
+# with the number of distinct files.
+#
+# With an atlas built by atlas.py in use, every sprite is instead a
+# sub-rectangle of the atlas's single texture, and nothing is read from sprites/
+# at all.
+
+import ctypes
+import os
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+import sdl2
+from helpers import sdl, texture_from_bmp, bmp_size
+
+if TYPE_CHECKING:
+    from atlas import Atlas, Region
+
+
+def renderer_key(renderer: Optional[sdl2.render.SDL_Renderer]) -> int:
+    """Textures belong to the renderer that created them, so the renderer is
+    part of a cache key. Running headless, there's no renderer and the key is
+    0."""
+    if renderer is None:
+        return 0
+    return ctypes.cast(renderer, ctypes.c_void_p).value or 0
+
+
+class CachedTexture:
+    def __init__(self, texture: Optional[sdl2.render.SDL_Texture],
+                 width: int, height: int,
+                 region: Optional["Region"] = None,
+                 atlas_width: int = 0, atlas_height: int = 0) -> None:
+        # Running headless, texture is None, but width and height are known.
+        self.texture = texture
+        self.width = width
+        self.height = height
+        self.references = 0
+
+        # Part of texture to draw, as a rectangle for SDL_RenderCopyEx() and as
+        # texture coordinates u0, v0, u1, v1 for SDL_RenderGeometry(). A sprite
+        # loaded from its own file covers its whole texture.
+        self.source: Optional[ctypes._Pointer] = None  # pylint: disable=protected-access
+        self.uv = (0.0, 0.0, 1.0, 1.0)
+
+        # Point the sprite is positioned and rotated by, relative to its upper
+        # left corner. center is the same point for SDL_RenderCopyEx(), left
+        # None for the sprite's center, which SDL defaults to.
+        self.pivot_x = width / 2
+        self.pivot_y = height / 2
+        self.center: Optional[ctypes._Pointer] = None  # pylint: disable=protected-access
+
+        # Atlas textures are shared by every sprite in the atlas, so they're
+        # destroyed along with the cache rather than with their last user.
+        self.shared = region is not None
+        if region is not None:
+            self.source = ctypes.pointer(sdl2.SDL_Rect(
+                region.x, region.y, region.width, region.height))
+            self.uv = (region.x / atlas_width, region.y / atlas_height,
+                       (region.x + region.width) / atlas_width,
+                       (region.y + region.height) / atlas_height)
+            self.pivot_x = region.pivot_x
+            self.pivot_y = region.pivot_y
+            if (self.pivot_x, self.pivot_y) != (width / 2, height / 2):
+                self.center = ctypes.pointer(sdl2.SDL_Point(
+                    int(self.pivot_x), int(self.pivot_y)))
+
+        # However it's rotated, a sprite never reaches further from its pivot
+        # than its furthest horizontal plus its furthest vertical edge, which
+        # saves computing its rotated bounds when culling.
+        self.reach = max(self.pivot_x, width - self.pivot_x) + \
+            max(self.pivot_y, height - self.pivot_y)
+
+
+class TextureCache:
+    """Loads each file once per renderer and hands out the same texture to
+    everyone asking for it. The texture is destroyed when the last user
+    releases it."""
+
+    def __init__(self) -> None:
+        self.entries: Dict[Tuple[str, int], CachedTexture] = {}
+        self.atlas: Optional["Atlas"] = None
+
+        # Atlas texture per renderer key.
+        self.atlas_textures: Dict[int, Optional[sdl2.render.SDL_Texture]] = {}
+
+    def use_atlas(self, atlas: "Atlas") -> None:
+        """Takes sprites found in atlas from it rather than from their files
+        from now on."""
+        self.atlas = atlas
+
+    def acquire(self, renderer: Optional[sdl2.render.SDL_Renderer],
+                filename: str) -> CachedTexture:
+        key = (filename, renderer_key(renderer))
+        entry = self.entries.get(key)
+        atlas = self.atlas
+        region = atlas.sprites.get(atlas_name(filename)) \
+            if atlas is not None else None
+        if entry is None and atlas is not None and region is not None:
+            if key[1] not in self.atlas_textures:
+                self.atlas_textures[key[1]] = atlas.create_texture(renderer)
+            entry = CachedTexture(self.atlas_textures[key[1]], region.width,
+                                  region.height, region, atlas.width,
+                                  atlas.height)
+            self.entries[key] = entry
+        elif entry is None:
+            texture = texture_from_bmp(renderer, filename)
+            if texture is None:
+                width, height = bmp_size(filename)
+            else:
+                w = ctypes.c_int(0)
+                h = ctypes.c_int(0)
+                sdl(sdl2.SDL_QueryTexture(texture, None, None,
+                                          ctypes.byref(w), ctypes.byref(h)))
+                width, height = w.value, h.value
+            entry = CachedTexture(texture, width, height)
+            self.entries[key] = entry
+        entry.references += 1
+        return entry
+
+    def release(self, renderer: Optional[sdl2.render.SDL_Renderer],
+                filename: str) -> None:
+        key = (filename, renderer_key(renderer))
+        entry = self.entries[key]
+        entry.references -= 1
+        if entry.references == 0:
+            if entry.texture is not None and not entry.shared:
+                sdl2.SDL_DestroyTexture(entry.texture)
+            del self.entries[key]
+
+    def clear(self) -> None:
+        """Destroys every texture regardless of references. Must be called
+        before destroying the renderer owning the textures."""
+        for entry in self.entries.values():
+            if entry.texture is not None and not entry.shared:
+                sdl2.SDL_DestroyTexture(entry.texture)
+        self.entries.clear()
+        for texture in self.atlas_textures.values():
+            if texture is not None:
+                sdl2.SDL_DestroyTexture(texture)
+        self.atlas_textures.clear()
+
+
+def atlas_name(filename: str) -> str:
+    """Name of a sprite in an atlas, its path with forward slashes."""
+    return os.path.normpath(filename).replace(os.sep, "/")
+
+
+class Sequence():
+    """A sequence of animation frames. Sequences are immutable and shared
+    among every entity playing them. Which frame each entity shows, and when
+    it changes, is up to its world's AnimationSystem."""
+
+    def __init__(self, renderer: Optional[sdl2.render.SDL_Renderer],
+                 filepath: str, sample_rate: int, loop: bool):
+        """ Creates a sequence from a list of files in filepath, or from the
+        frames listed by the atlas in use, if it has the sequence. The atlas
+        then also decides sample_rate and loop, as recorded when it was
+        built."""
+        self.renderer = renderer
+        atlas = Texture_cache.atlas
+        info = atlas.sequences.get(atlas_name(filepath)) \
+            if atlas is not None else None
+        if info is not None:
+            self.filenames = list(info.frames)
+            sample_rate = info.frame_rate
+            loop = info.loop
+        else:
+            self.filenames = [os.path.join(filepath, filename)
+                              for filename in sorted(os.listdir(filepath))]
+        self.frames: List[CachedTexture] = [
+            Texture_cache.acquire(renderer, filename)
+            for filename in self.filenames]
+
+        # Number of times to advance a frame per second
+        self.sample_rate = sample_rate
+        self.loop = loop
+
+    def release(self) -> None:
+        for filename in self.filenames:
+            Texture_cache.release(self.renderer, filename)
+
+
+class SequenceCache:
+    """Hands out a shared Sequence per distinct set of arguments, the
+    flyweight pattern. Like TextureCache, it counts references and releases
+    the sequence's textures when the last user releases it."""
+
+    def __init__(self) -> None:
+        self.entries: Dict[Tuple[str, int, int, bool], Sequence] = {}
+        self.references: Dict[Tuple[str, int, int, bool], int] = {}
+
+    def acquire(self, renderer: Optional[sdl2.render.SDL_Renderer],
+                filepath: str, sample_rate: int, loop: bool) -> Sequence:
+        key = (filepath, renderer_key(renderer), sample_rate, loop)
+        if key not in self.entries:
+            self.entries[key] = Sequence(renderer, filepath, sample_rate, loop)
+            self.references[key] = 0
+        self.references[key] += 1
+        return self.entries[key]
+
+    def release(self, sequence: Sequence) -> None:
+        for key, entry in self.entries.items():
+            if entry is sequence:
+                self.references[key] -= 1
+                if self.references[key] == 0:
+                    entry.release()
+                    del self.entries[key]
+                    del self.references[key]
+                return
+
+
+Texture_cache = TextureCache()
+Sequence_cache = SequenceCache()
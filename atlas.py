@@ -0,0 +1,232 @@
+# Sprite atlas. Loading sprites one file at a time means listing directories
+# and decoding a BMP per animation frame, followed by uploading a texture per
+# frame to the GPU. Instead, a build step packs every sprite under sprites/
+# into a single image, stored along with an index in one file:
+#
+#   $ python3 atlas.py
+#
+# At startup the file is memory-mapped and uploaded as one texture, so there's
+# one file to open and one texture to create however many sprites the game has.
+# Sprites are drawn as sub-rectangles of the atlas texture, and as every sprite
+# then shares a texture, the sprite batch can submit a whole layer in a single
+# call. The atlas must be rebuilt whenever a sprite changes.
+#
+# Layout, little-endian:
+#
+#   HEADER
+#   SPRITE record per sprite, each following its name
+#   SEQUENCE record per animation sequence, each following its name and
+#   followed by the sprite index of each of its frames
+#   Pixels of the atlas at pixels_offset, RGBA, one byte per channel, rows top
+#   to bottom without padding
+#
+# Names are UTF-8 prefixed by their length as NAME.
+
+import argparse
+import ctypes
+import mmap
+import os
+import struct
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+import sdl2
+from helpers import sdl
+import config
+
+MAGIC = b"SIAT"
+VERSION = 1
+
+# Magic, version, atlas width and height, number of sprites, number of
+# sequences, and offset of the pixels.
+HEADER = struct.Struct("<4sBHHHHI")
+
+NAME = struct.Struct("<H")
+
+# Position and size of the sprite within the atlas, and its pivot, the point
+# relative to its upper left corner it's positioned and rotated by.
+SPRITE = struct.Struct("<HHHHff")
+
+# Frames per second, whether the sequence loops, and number of frames.
+SEQUENCE = struct.Struct("<H?H")
+FRAME = struct.Struct("<H")
+
+# Sprites are spaced apart so filtering never blends in a neighbor's pixels.
+PADDING = 1
+
+
+class Region(NamedTuple):
+    x: int
+    y: int
+    width: int
+    height: int
+    pivot_x: float
+    pivot_y: float
+
+
+class SequenceInfo(NamedTuple):
+    frame_rate: int
+    loop: bool
+    frames: List[str]
+
+
+def sprite_files(root: str) -> List[str]:
+    """Every BMP under root, in a stable order."""
+    files = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        files.extend(os.path.join(directory, filename)
+                     for filename in sorted(filenames)
+                     if filename.lower().endswith(".bmp"))
+    return files
+
+
+def load_pixels(filename: str) -> np.ndarray:
+    """Pixels of a BMP as a height x width x RGBA array."""
+    image = sdl(sdl2.SDL_LoadBMP(filename.encode()))
+    converted = sdl(sdl2.SDL_ConvertSurfaceFormat(
+        image, sdl2.SDL_PIXELFORMAT_RGBA32, 0))
+    sdl2.SDL_FreeSurface(image)
+    surface = converted.contents
+    width, height, pitch = surface.w, surface.h, surface.pitch
+    data = ctypes.string_at(surface.pixels, pitch * height)
+    sdl2.SDL_FreeSurface(converted)
+    rows = np.frombuffer(data, dtype=np.uint8).reshape(height, pitch)
+    return rows[:, :4 * width].reshape(height, width, 4)
+
+
+def pack(sizes: List[Tuple[int, int]]) -> Tuple[int, int, List[Tuple[int, int]]]:
+    """Places rectangles of sizes on shelves, tallest first, in the narrowest
+    power of two wide atlas that's no taller than wide. Returns the atlas
+    width and height, and the position of each rectangle."""
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], i))
+    width = 64
+    while True:
+        positions: List[Tuple[int, int]] = [(0, 0)] * len(sizes)
+        x = y = shelf_height = 0
+        fits = True
+        for i in order:
+            w, h = sizes[i]
+            if w + PADDING > width:
+                fits = False
+                break
+            if x + w + PADDING > width:
+                x = 0
+                y += shelf_height
+                shelf_height = 0
+            positions[i] = (x, y)
+            x += w + PADDING
+            shelf_height = max(shelf_height, h + PADDING)
+        height = y + shelf_height
+        if fits and height <= width:
+            return width, height, positions
+        width *= 2
+
+
+def build(root: str, output: str) -> None:
+    files = sprite_files(root)
+    images = [load_pixels(filename) for filename in files]
+    width, height, positions = pack(
+        [(image.shape[1], image.shape[0]) for image in images])
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    for image, (x, y) in zip(images, positions):
+        pixels[y:y + image.shape[0], x:x + image.shape[1]] = image
+
+    # Names are stored as used by the game, relative to where it runs.
+    names = [os.path.relpath(f).replace(os.sep, "/") for f in files]
+    index = {name: i for i, name in enumerate(names)}
+    sequences = {path: (rate, loop, [n for n in names
+                                     if n.rsplit("/", 1)[0] == path])
+                 for path, (rate, loop) in config.SEQUENCES.items()}
+
+    body = bytearray()
+    for name, image, (x, y) in zip(names, images, positions):
+        h, w = image.shape[:2]
+        body += encode_name(name)
+        body += SPRITE.pack(x, y, w, h, w / 2, h / 2)
+    for path, (rate, loop, frames) in sequences.items():
+        body += encode_name(path)
+        body += SEQUENCE.pack(rate, loop, len(frames))
+        for frame in frames:
+            body += FRAME.pack(index[frame])
+
+    # Pixels are aligned for the benefit of whoever reads them.
+    pixels_offset = (HEADER.size + len(body) + 63) // 64 * 64
+    with open(output, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, width, height, len(names),
+                            len(sequences), pixels_offset))
+        f.write(body)
+        f.write(bytes(pixels_offset - HEADER.size - len(body)))
+        f.write(pixels.tobytes())
+    print(f"Packed {len(names)} sprites and {len(sequences)} sequences into "
+          f"a {width}x{height} atlas in {output}")
+
+
+def encode_name(name: str) -> bytes:
+    encoded = name.encode()
+    return NAME.pack(len(encoded)) + encoded
+
+
+class Atlas:
+    """Atlas built by build(), memory-mapped rather than read, so pixels are
+    only paged in when uploaded to a texture."""
+
+    def __init__(self, filename: str) -> None:
+        with open(filename, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.width, self.height, sprite_count, \
+            sequence_count, self.pixels_offset = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{filename} isn't a version {VERSION} atlas")
+
+        self.sprites: Dict[str, Region] = {}
+        names: List[str] = []
+        offset = HEADER.size
+        for _ in range(sprite_count):
+            name, offset = self.read_name(offset)
+            self.sprites[name] = Region(*SPRITE.unpack_from(self.data, offset))
+            names.append(name)
+            offset += SPRITE.size
+
+        self.sequences: Dict[str, SequenceInfo] = {}
+        for _ in range(sequence_count):
+            name, offset = self.read_name(offset)
+            rate, loop, count = SEQUENCE.unpack_from(self.data, offset)
+            offset += SEQUENCE.size
+            frames = [names[FRAME.unpack_from(self.data, offset + i * FRAME.size)[0]]
+                      for i in range(count)]
+            offset += count * FRAME.size
+            self.sequences[name] = SequenceInfo(rate, loop, frames)
+
+    def read_name(self, offset: int) -> Tuple[str, int]:
+        length, = NAME.unpack_from(self.data, offset)
+        offset += NAME.size
+        return bytes(self.data[offset:offset + length]).decode(), \
+            offset + length
+
+    def create_texture(self, renderer: Optional[sdl2.render.SDL_Renderer]
+                       ) -> Optional[sdl2.render.SDL_Texture]:
+        """Uploads the atlas straight from the mapped file. Without a renderer,
+        as when running headless, nothing is uploaded and None is returned."""
+        if renderer is None:
+            return None
+        texture = sdl(sdl2.SDL_CreateTexture(
+            renderer, sdl2.SDL_PIXELFORMAT_RGBA32,
+            sdl2.SDL_TEXTUREACCESS_STATIC, self.width, self.height))
+        pixels = np.frombuffer(self.data, dtype=np.uint8,
+                               count=self.width * self.height * 4,
+                               offset=self.pixels_offset)
+        sdl(sdl2.SDL_UpdateTexture(
+            texture, None, pixels.ctypes.data_as(ctypes.c_void_p),
+            self.width * 4))
+        sdl(sdl2.SDL_SetTextureBlendMode(texture, sdl2.SDL_BLENDMODE_BLEND))
+        return texture
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Packs every sprite into a single atlas")
+    parser.add_argument("--sprites", default="sprites",
+                        help="directory searched for BMPs")
+    parser.add_argument("--output", default=config.ATLAS_FILE)
+    args = parser.parse_args()
+    build(args.sprites, args.output)
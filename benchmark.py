@@ -0,0 +1,275 @@
+# Benchmark suite measuring how the game's systems scale with entity count.
+# Worlds are built from the same factories the game uses, at sizes from tens to
+# hundreds of thousands of entities, and each system is run for a number of
+# ticks without user input. Results are written as JSON so that a later run can
+# be compared against a saved baseline to catch regressions.
+#
+#   $ python3 benchmark.py --output baseline.json
+#   $ python3 benchmark.py --compare baseline.json
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, cast
+import sdl2
+from helpers import sdl, Vec2f
+import entities
+import systems
+from pool import Pool
+from storage import ArrayStorage
+from world import World
+import collision
+import config
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+
+# The game has 46 entities on a SCREEN_WIDTH x SCREEN_HEIGHT screen. Larger
+# worlds get a proportionally larger playfield to keep entity density, and with
+# it the number of overlapping entities, comparable to the game.
+GAME_ENTITY_COUNT = 46
+
+# Share of entities that are bullets, the rest being enemies and one player.
+BULLET_SHARE = 0.5
+
+
+def build_world(renderer: Optional[sdl2.render.SDL_Renderer], size: int,
+                storage: str) -> World:
+    world = World(ArrayStorage(size) if storage == "numpy" else None)
+    scale = math.sqrt(max(size, GAME_ENTITY_COUNT) / GAME_ENTITY_COUNT)
+    config.SCREEN_WIDTH = int(SCREEN_WIDTH * scale)
+    config.SCREEN_HEIGHT = int(SCREEN_HEIGHT * scale)
+
+    world.add(entities.create_player(world, renderer))
+    bullets = int((size - 1) * BULLET_SHARE)
+    entities.initialize_bullet_pool(world, renderer, bullets)
+    entities.initialize_enemy_pool(world, renderer, size - 1 - bullets)
+    replenish(world)
+    return world
+
+
+def replenish(world: World) -> None:
+    """Fires bullets from random positions along the bottom of the playfield
+    and brings destroyed enemies back until every pooled entity is in use,
+    keeping the load steady. Not part of any measurement."""
+    bullet_pool = cast(Pool, world.bullet_pool)
+    while bullet_pool.active_count < len(bullet_pool.entities):
+        bullet = cast(entities.Entity, bullet_pool.acquire())
+        bullet.position.x = random.uniform(0, config.SCREEN_WIDTH)
+        bullet.position.y = random.uniform(
+            config.SCREEN_HEIGHT / 2, config.SCREEN_HEIGHT)
+        bullet.rotation = 270 * (math.pi / 180)
+        bullet.store_previous_state()
+        bullet.update()
+
+    enemy_pool = cast(Pool, world.enemy_pool)
+    while enemy_pool.active_count < len(enemy_pool.entities):
+        entities.enemy_from_pool(
+            world, Vec2f(random.uniform(0, config.SCREEN_WIDTH),
+                  random.uniform(0, config.SCREEN_HEIGHT / 2)))
+    world.commands.flush()
+
+
+def make_systems(world: World, renderer: Optional[sdl2.render.SDL_Renderer]
+                 ) -> Dict[str, Callable[[], None]]:
+    def run_draw() -> None:
+        sdl(sdl2.SDL_RenderClear(renderer))
+        systems.draw(world, renderer)
+        sdl(sdl2.SDL_RenderPresent(renderer))
+
+    measured: Dict[str, Callable[[], None]] = {
+        "update": lambda: systems.update(world),
+        "collision": lambda: collision.check_collisions(world),
+    }
+    if renderer is not None:
+        measured["draw"] = run_draw
+    return measured
+
+
+def measure(world: World, measured: Dict[str, Callable[[], None]], ticks: int,
+            trace: bool) -> Dict[str, Dict[str, float]]:
+    """Runs every system once per tick in order. With trace, memory rather
+    than time is measured, as tracing slows down Python considerably."""
+    totals = {name: 0.0 for name in measured}
+    blocks = {name: 0 for name in measured}
+    peaks = {name: 0 for name in measured}
+    for _ in range(ticks):
+        # As in systems.run_tick(). Collision detection tells fast movers by
+        # how far they moved since.
+        for entity in world.entities:
+            entity.store_previous_state()
+        for name, system in measured.items():
+            if trace:
+                reset_peak()
+                before_blocks = sys.getallocatedblocks()
+                before_size, _ = tracemalloc.get_traced_memory()
+                system()
+                _, peak = tracemalloc.get_traced_memory()
+                blocks[name] += sys.getallocatedblocks() - before_blocks
+                peaks[name] = max(peaks[name], peak - before_size)
+            else:
+                start = time.perf_counter()
+                system()
+                totals[name] += time.perf_counter() - start
+        replenish(world)
+        world.advance()
+
+    if trace:
+        return {name: {"allocated_blocks_per_tick": blocks[name] / ticks,
+                       "peak_memory_kb": peaks[name] / 1024}
+                for name in measured}
+    return {name: {"ms_per_tick": totals[name] / ticks * 1000}
+            for name in measured}
+
+
+def create_renderer() -> Optional[sdl2.render.SDL_Renderer]:
+    """Creates a software renderer on a hidden window, which works on machines
+    without a display when SDL_VIDEODRIVER=dummy."""
+    if sdl2.SDL_InitSubSystem(sdl2.SDL_INIT_VIDEO) < 0:
+        return None
+    window = sdl2.SDL_CreateWindow(
+        b"Benchmark", sdl2.SDL_WINDOWPOS_UNDEFINED,
+        sdl2.SDL_WINDOWPOS_UNDEFINED, SCREEN_WIDTH, SCREEN_HEIGHT,
+        sdl2.SDL_WINDOW_HIDDEN)
+    if not window:
+        return None
+    renderer = sdl2.SDL_CreateRenderer(
+        window, -1, sdl2.SDL_RENDERER_SOFTWARE)
+    return renderer if renderer else None
+
+
+def run(sizes: List[int], ticks: int, broadphase: str, storage: str,
+        draw: bool) -> Dict[str, Any]:
+    random.seed(0)
+    collision.set_broadphase(broadphase)
+    renderer = create_renderer() if draw else None
+    if draw and renderer is None:
+        print(f"Skipping draw: {sdl2.SDL_GetError().decode()}",
+              file=sys.stderr)
+
+    results = []
+    for size in sizes:
+        world = build_world(renderer, size, storage)
+        measured = make_systems(world, renderer)
+        timings = measure(world, measured, ticks, trace=False)
+
+        tracemalloc.start()
+        memory = measure(world, measured, max(1, ticks // 10), trace=True)
+        tracemalloc.stop()
+        entities.destroy_game(world)
+
+        for name in measured:
+            result = {"entities": size, "system": name}
+            result.update(timings[name])
+            result.update(memory[name])
+            results.append(result)
+            print(f"{size:>7} {name:<10} {timings[name]['ms_per_tick']:10.3f} ms/tick "
+                  f"{memory[name]['allocated_blocks_per_tick']:10.1f} blocks/tick "
+                  f"{memory[name]['peak_memory_kb']:10.1f} KB peak")
+
+    config.SCREEN_WIDTH = SCREEN_WIDTH
+    config.SCREEN_HEIGHT = SCREEN_HEIGHT
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "ticks": ticks,
+            "broadphase": broadphase,
+            "storage": storage,
+        },
+        "results": results,
+    }
+
+
+def reset_peak() -> None:
+    """Starts measuring peak traced memory from the current size.
+    tracemalloc.reset_peak() is only available from Python 3.9, and before
+    that, restarting tracing has the same effect, if less cheaply."""
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.stop()
+        tracemalloc.start()
+
+
+# Settings which must be the same for timings to be comparable.
+COMPARABLE = ["ticks", "broadphase", "storage"]
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any],
+            tolerance: float) -> List[str]:
+    """Returns a description of each system at each size that got slower by
+    more than tolerance, a fraction, compared to baseline. Raises ValueError
+    if baseline was run with different settings."""
+    differences = [
+        f"{key} {baseline['meta'].get(key)!r} in baseline, "
+        f"{report['meta'].get(key)!r} now"
+        for key in COMPARABLE
+        if baseline.get("meta", {}).get(key) != report["meta"].get(key)]
+    if differences:
+        raise ValueError("Baseline isn't comparable: " +
+                         ", ".join(differences))
+
+    previous = {(r["entities"], r["system"]): r for r in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        key = (result["entities"], result["system"])
+        if key not in previous:
+            continue
+        before = previous[key]["ms_per_tick"]
+        after = result["ms_per_tick"]
+        if after > before * (1 + tolerance):
+            regressions.append(
+                f"{key[1]} at {key[0]} entities: {before:.3f} -> {after:.3f} "
+                f"ms/tick (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+# Screen size is scaled per world size, so hold on to the game's.
+SCREEN_WIDTH = config.SCREEN_WIDTH
+SCREEN_HEIGHT = config.SCREEN_HEIGHT
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Space Invaders benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="entity counts to benchmark")
+    parser.add_argument("--ticks", type=int, default=100,
+                        help="ticks to run each system for per size")
+    parser.add_argument("--broadphase", choices=sorted(collision.BROADPHASES),
+                        default="spatial_hash")
+    parser.add_argument("--storage", choices=["objects", "numpy"],
+                        default="objects")
+    parser.add_argument("--no-draw", action="store_true",
+                        help="skip the draw system")
+    parser.add_argument("--output", help="write results to JSON file")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="flag regressions against a saved JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="slowdown tolerated before flagging, as a fraction")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    sdl(sdl2.SDL_Init(sdl2.SDL_INIT_TIMER))
+    report = run(args.sizes, args.ticks, args.broadphase, args.storage,
+                 not args.no_draw)
+    sdl2.SDL_Quit()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            try:
+                found = compare(report, json.load(f), args.tolerance)
+            except ValueError as error:
+                print(error)
+                sys.exit(2)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if found else 0)
@@ -0,0 +1,124 @@
+# Structural changes to a world, such as entities entering or leaving play,
+# being activated, or gaining and losing components, used to happen right away,
+# in the middle of systems iterating over the world. A bullet fired by
+# KeyboardShooter joined the world while the update system was still looping,
+# and bullets and enemies left it during the same pass, so iteration order
+# decided behavior and every query had to iterate over a copy of the index.
+#
+# Instead, such changes are recorded in the world's CommandBuffer while systems
+# run, and applied together when the buffer is flushed at sync points between
+# systems. Commands cancelling out, such as a bullet fired and leaving the
+# screen in the same tick, are dropped, and every other entity has its
+# membership and index entries updated once per flush rather than once per
+# command. Entities end up in the same order as if every command had been
+# applied right away, so the game plays out the same.
+
+from typing import Dict, List, Tuple, Type, TYPE_CHECKING, Union
+
+if TYPE_CHECKING:
+    import components
+    import entities
+    from world import World
+
+SPAWN = 0
+DESPAWN = 1
+ACTIVATE = 2
+ADD_COMPONENT = 3
+REMOVE_COMPONENT = 4
+
+Argument = Union[None, bool, "components.Component",
+                 Type["components.Component"]]
+Command = Tuple[int, "entities.Entity", Argument]
+
+
+class CommandBuffer:
+    def __init__(self, world: "World") -> None:
+        self.world = world
+        self.commands: List[Command] = []
+
+        # Whether entities with commands pending will be active once they're
+        # applied.
+        self.pending: Dict["entities.Entity", bool] = {}
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def spawn(self, entity: "entities.Entity") -> None:
+        """Brings entity into play, active."""
+        self.commands.append((SPAWN, entity, None))
+        self.pending[entity] = True
+
+    def despawn(self, entity: "entities.Entity") -> None:
+        """Takes entity out of play, inactive."""
+        self.commands.append((DESPAWN, entity, None))
+        self.pending[entity] = False
+
+    def activate(self, entity: "entities.Entity", active: bool) -> None:
+        self.commands.append((ACTIVATE, entity, active))
+        self.pending[entity] = active
+
+    def will_be_active(self, entity: "entities.Entity") -> bool:
+        """Whether entity is active once pending commands are applied. Lets
+        systems respect changes made earlier in the same pass, such as a
+        bullet destroyed by its first hit, without flushing in between."""
+        return self.pending.get(entity, entity.active)
+
+    def add_component(self, entity: "entities.Entity",
+                      component: "components.Component") -> None:
+        self.commands.append((ADD_COMPONENT, entity, component))
+
+    def remove_component(self, entity: "entities.Entity",
+                         component_type: Type["components.Component"]) -> None:
+        self.commands.append((REMOVE_COMPONENT, entity, component_type))
+
+    def flush(self) -> None:
+        """Applies every command recorded since the previous flush. Must not
+        be called while iterating over the world."""
+        if not self.commands:
+            return
+        commands = self.commands
+        self.commands = []
+        self.pending = {}
+        world = self.world
+        in_play = world.entities
+
+        # Components change first, so entities entering play below are
+        # indexed with the components they ended up with.
+        for op, entity, argument in commands:
+            if op == ADD_COMPONENT:
+                entity.attach_component(argument)  # type: ignore
+            elif op == REMOVE_COMPONENT:
+                entity.detach_component(argument)  # type: ignore
+
+        # Net change in membership. Entities in play and never taken out keep
+        # their place. The rest are appended in order of when they last
+        # entered play, like adding them one command at a time would.
+        removed: Dict["entities.Entity", None] = {}
+        added: Dict["entities.Entity", None] = {}
+        active: Dict["entities.Entity", bool] = {}
+        for op, entity, argument in commands:
+            if op == SPAWN:
+                active[entity] = True
+                if entity not in added and (
+                        entity not in in_play or entity in removed):
+                    added[entity] = None
+            elif op == DESPAWN:
+                active[entity] = False
+                if entity in added:
+                    del added[entity]
+                elif entity in in_play:
+                    removed[entity] = None
+            elif op == ACTIVATE:
+                active[entity] = bool(argument)
+
+        for entity in removed:
+            world.remove(entity)
+        for entity in added:
+            world.add(entity)
+        for entity, value in active.items():
+            entity.active = value
+
+    def clear(self) -> None:
+        """Drops every command recorded since the previous flush."""
+        self.commands.clear()
+        self.pending.clear()
@@ -1,10 +1,11 @@
-import ctypes
-import os
 import math
-from typing import Dict, List, cast
+from typing import Any, Callable, Dict, List, Optional, Tuple, cast
 from abc import ABC, abstractclassmethod
 import sdl2
-from helpers import sdl, draw_texture, texture_from_bmp
+from assets import CachedTexture, Sequence, Sequence_cache, Texture_cache
+import controls
+from spritebatch import Sprite_batch
+from collision import LAYER_NONE, LAYER_BULLET, LAYER_ENEMY
 import config
 import entities
 
@@ -15,6 +16,27 @@ class Component(ABC):
     any behavior. In this simple ECS implementation, we make each component
     support three events, though they sometimes have a no-op implementation."""
 
+    # Collision layers, see collision.LAYER_*, this component wants to hear
+    # about collisions with. Collisions with other layers aren't passed on.
+    collides_with = LAYER_NONE
+
+    # struct format of the values returned by get_state(). Components whose
+    # state changes during the game override it along with get_state() and
+    # set_state(), so their state can be captured in snapshots.
+    state_format = ""
+
+    def get_state(self) -> Tuple[Any, ...]:
+        return ()
+
+    def set_state(self, state: Tuple[Any, ...]) -> None:
+        pass
+
+    def added(self) -> None:
+        """Called when the container entity enters play."""
+
+    def removed(self) -> None:
+        """Called when the container entity leaves play."""
+
     @abstractclassmethod
     def update(cls) -> None:
         """Called every frame to update component's game state."""
@@ -31,29 +53,37 @@ class Component(ABC):
         entity. other is the Entity with which we collided."""
         raise NotImplementedError
 
+    def release(self) -> None:
+        """Called when the container entity is destroyed, to give back shared
+        assets, such as cached textures."""
+
 
 class SpriteRenderer(Component):
     """Rendering a sprite is a piece of functionality shared among components."""
 
-    def __init__(self, renderer: sdl2.render.SDL_Renderer,
+    def __init__(self, renderer: Optional[sdl2.render.SDL_Renderer],
                  container: "entities.Entity", filename: str):
         # Container of this component
         self.container = container
 
-        # Never explicitly deallocated, but reclaimed by the operating system
-        # when the game exits.
-        self.texture = texture_from_bmp(renderer, filename)
+        # Shared with every other SpriteRenderer of the same file. Running
+        # headless there's no texture, but other components, such as
+        # KeyboardMover, still depend on the size of the sprite.
+        self.renderer = renderer
+        self.filename = filename
+        self.sprite = Texture_cache.acquire(renderer, filename)
+        self.texture = self.sprite.texture
+        self.width = float(self.sprite.width)
+        self.height = float(self.sprite.height)
 
-        # Dynamically determine width and height of sprite over using constants.
-        w = ctypes.pointer(ctypes.c_int(0))
-        h = ctypes.pointer(ctypes.c_int(0))
-        sdl(sdl2.SDL_QueryTexture(self.texture, None, None, w, h))
-        self.width = float(w.contents.value)
-        self.height = float(h.contents.value)
+    @property
+    def current_sprite(self) -> CachedTexture:
+        return self.sprite
 
     def draw(self, renderer: sdl2.render.SDL_Renderer) -> None:
         con = self.container
-        draw_texture(renderer, self.texture, con.position, con.rotation)
+        Sprite_batch.add(self.sprite, con.interpolated_position(),
+                         con.interpolated_rotation(), con.draw_layer)
 
     def update(self) -> None:
         pass
@@ -61,105 +91,166 @@ class SpriteRenderer(Component):
     def collision(self, other: "entities.Entity") -> None:
         pass
 
-
-class Sequence():
-    def __init__(self, renderer: sdl2.render.SDL_Renderer, filepath: str,
-                 sample_rate: int, loop: bool):
-        """ Creates a sequence from a list of files in filepath."""
-        self.textures: List[sdl2.render.SDL_Texture] = []
-        for filename in sorted(os.listdir(filepath)):
-            self.textures.append(
-                texture_from_bmp(renderer, os.path.join(filepath, filename)))
-
-        # Number of times to update current_frame per second
-        self.sample_rate = sample_rate
-        self.loop = loop
-
-        # Index into textures list
-        self.current_frame = 0
-
-    def current_texture(self) -> sdl2.render.SDL_Texture:
-        return self.textures[self.current_frame]
-
-    def next_frame(self) -> bool:
-        if self.current_frame == len(self.textures) - 1:
-            if self.loop:
-                self.current_frame = 0
-            else:
-                return True
-        else:
-            self.current_frame += 1
-        return False
+    def release(self) -> None:
+        Texture_cache.release(self.renderer, self.filename)
 
 
 class Animator(Component):
+    """Handle to an entity's state in its world's AnimationSystem, which
+    advances every Animator at once. update() therefore does nothing."""
+
     def __init__(self, container: "entities.Entity", sequences:
                  Dict[str, Sequence], default_sequence: str):
         self.container = container
+
+        # Sequences are shared among entities. Where the entity is in the
+        # sequence playing is kept by the animation system.
         self.sequences = sequences
-        self.last_frame_change = sdl2.SDL_GetTicks()
-        self.finished = False
+        self.system = container.world.animations
+        self.names = sorted(sequences)
+        self.ids = {name: self.system.register_sequence(sequences[name])
+                    for name in self.names}
+        self.names_by_id = {id_: name for name, id_ in self.ids.items()}
+        self.slot = self.system.register_animator(self)
+
+        # Called with the name of a non-looping sequence when it finishes.
+        self.listeners: List[Callable[[str], None]] = []
+
+        self.set_sequence(default_sequence)
 
-        # Key used to index into self.sequences dictionary
-        self.current_animation_playing = default_sequence
+    @property
+    def current_animation_playing(self) -> str:
+        """Key used to index into self.sequences dictionary"""
+        return self.names_by_id[int(self.system.sequence_ids[self.slot])]
+
+    @property
+    def current_frame(self) -> int:
+        return int(self.system.frames[self.slot])
+
+    @property
+    def finished(self) -> bool:
+        return bool(self.system.finished[self.slot])
 
     def set_sequence(self, name: str) -> None:
-        self.current_animation_playing = name
-        self.last_frame_change = sdl2.SDL_GetTicks()
+        self.system.play(self.slot, self.ids[name],
+                         self.container.world.time_ms)
+
+    def notify_finished(self) -> None:
+        name = self.current_animation_playing
+        for listener in self.listeners:
+            listener(name)
+
+    def added(self) -> None:
+        self.system.enabled[self.slot] = True
+
+    def removed(self) -> None:
+        self.system.enabled[self.slot] = False
+
+    @property
+    def current_sprite(self) -> CachedTexture:
+        return self.sequences[
+            self.current_animation_playing].frames[self.current_frame]
 
     def draw(self, renderer: sdl2.render.SDL_Renderer) -> None:
-        texture = self.sequences[
-            self.current_animation_playing].current_texture()
         con = self.container
-        draw_texture(renderer, texture, con.position, con.rotation)
+        Sprite_batch.add(self.current_sprite, con.interpolated_position(),
+                         con.interpolated_rotation(), con.draw_layer)
 
     def update(self) -> None:
-        sequence = self.sequences[self.current_animation_playing]
-        frame_interval = 1000.0 / sequence.sample_rate
-
-        if (sdl2.SDL_GetTicks() - self.last_frame_change) >= frame_interval:
-            self.finished = sequence.next_frame()
-            self.last_frame_change = sdl2.SDL_GetTicks()
+        pass
 
     def collision(self, other: "entities.Entity") -> None:
         pass
 
+    # Sequence playing, as an index into sorted sequence names, current frame,
+    # time of last frame change, and whether the sequence has finished.
+    state_format = "<BId?"
+
+    def get_state(self) -> Tuple[Any, ...]:
+        system = self.system
+        slot = self.slot
+        return (self.names.index(self.current_animation_playing),
+                self.current_frame, system.last_change[slot],
+                system.finished[slot])
+
+    def set_state(self, state: Tuple[Any, ...]) -> None:
+        system = self.system
+        slot = self.slot
+        sequence, system.frames[slot], system.last_change[slot], \
+            system.finished[slot] = state
+        system.sequence_ids[slot] = self.ids[self.names[sequence]]
+
+    def release(self) -> None:
+        for sequence in self.sequences.values():
+            Sequence_cache.release(sequence)
+
 
 class VulnerableToBullets(Component):
+    collides_with = LAYER_BULLET
+
     def __init__(self, container: "entities.Entity") -> None:
         self.container = container
         self.animator: Animator = cast(
             Animator, container.get_component(Animator))
+        self.animator.listeners.append(self.animation_finished)
 
     def draw(self, renderer: sdl2.render.SDL_Renderer) -> None:
         pass
 
     def update(self) -> None:
-        if self.animator.finished and self.animator.current_animation_playing == "destroy":
-            self.container.active = False
+        pass
+
+    def animation_finished(self, name: str) -> None:
+        if name == "destroy":
+            self.container.deactivate()
 
     def collision(self, other: "entities.Entity") -> None:
-        if other.tag == "bullet":
-            self.animator.set_sequence("destroy")
+        self.animator.set_sequence("destroy")
+
+
+def offscreen(x: float, y: float) -> bool:
+    return x > config.SCREEN_WIDTH or x < 0 or y > config.SCREEN_HEIGHT or y < 0
 
 
 class BulletMover(Component):
+    collides_with = LAYER_ENEMY
+
     def __init__(self, container: "entities.Entity", speed: float):
         self.container = container
         self.speed = speed
 
+        # Bullets have a single collision circle.
+        self.radius = container.collisions[0].radius
+
+        # With array storage, every bullet is moved at once by
+        # ArrayStorage.move_bullets() instead of one at a time below.
+        storage = container.world.array_storage
+        self.vectorized = storage is not None
+        if storage is not None:
+            storage.add_bullet(container, speed, self.radius)
+
     def draw(self, renderer: sdl2.render.SDL_Renderer) -> None:
         pass
 
     def update(self) -> None:
+        if self.vectorized:
+            return
+
         # Compute how much of bullet's speed should go in x and y directions.
         con = self.container
         pos = con.position
-        pos.x += self.speed * math.cos(con.rotation) * config.delta_time
-        pos.y += self.speed * math.sin(con.rotation) * config.delta_time
-
-        if pos.x > config.SCREEN_WIDTH or pos.x < 0 or pos.y > config.SCREEN_HEIGHT or pos.y < 0:
-            con.active = False
+        was_offscreen = offscreen(pos.x, pos.y)
+        step = self.speed * con.world.delta_time
+        pos.x += step * math.cos(con.rotation)
+        pos.y += step * math.sin(con.rotation)
+
+        # A bullet moving further than its diameter per tick may have passed
+        # through something on its way off the screen. Collision detection
+        # only finds that by sweeping the bullet's path while it's still in
+        # play, so such a bullet is taken out of play a tick later.
+        if offscreen(pos.x, pos.y) and (
+                step <= 2 * self.radius or was_offscreen):
+            con.deactivate()
 
         # We know there's only ever one collision point for bullet.
         con.collisions[0].center = con.position
@@ -171,7 +262,7 @@ class BulletMover(Component):
         # speaking isn't related to the bullet movement component. Argument
         # could be made that this functionality ought to be places in a separate
         # component.
-        self.container.active = False
+        self.container.deactivate()
 
 
 class KeyboardMover(Component):
@@ -198,13 +289,13 @@ class KeyboardMover(Component):
 
     def update(self) -> None:
         con = self.container
-        keys = sdl(sdl2.SDL_GetKeyboardState(None))
-        if keys[sdl2.SDL_SCANCODE_LEFT] == 1:
+        held = con.world.input.held
+        if held(controls.MOVE_LEFT):
             if con.position.x - self.sprite_renderer.width/2 > 0:
-                con.position.x -= self.speed * config.delta_time
-        elif keys[sdl2.SDL_SCANCODE_RIGHT] == 1:
+                con.position.x -= self.speed * con.world.delta_time
+        elif held(controls.MOVE_RIGHT):
             if con.position.x + self.sprite_renderer.width/2 < config.SCREEN_WIDTH:
-                con.position.x += self.speed * config.delta_time
+                con.position.x += self.speed * con.world.delta_time
 
     def collision(self, other: "entities.Entity") -> None:
         pass
@@ -221,24 +312,36 @@ class KeyboardShooter(Component):
 
     def update(self) -> None:
         pos = self.container.position
-        keys = sdl(sdl2.SDL_GetKeyboardState(None))
-        if keys[sdl2.SDL_SCANCODE_SPACE] == 1:
-            if (sdl2.SDL_GetTicks() - self.last_shot) >= self.cooldown:
+        world = self.container.world
+        if world.input.held(controls.FIRE):
+            now = world.time_ms
+            if (now - self.last_shot) >= self.cooldown:
                 # Player has two turrets
                 self.shoot(pos.x + 25, pos.y - 20)
                 self.shoot(pos.x - 25, pos.y - 20)
-                self.last_shot = sdl2.SDL_GetTicks()
+                self.last_shot = now
 
     def shoot(self, x: float, y: float) -> None:
         """Creates a bullet at (x,y) to allow bullet to originate from left and
         right gun turret instead of the player's center."""
-        bullet = entities.bullet_from_pool()
+        bullet = entities.bullet_from_pool(self.container.world)
         if bullet is not None:
-            bullet.active = True
             bullet.position.x = x
             bullet.position.y = y
             bullet.rotation = 270 * (math.pi / 180)  # degrees to radians
+
+            # Bullet appears at the turret rather than sliding in from where
+            # it was last seen.
+            bullet.store_previous_state()
             bullet.update()
 
     def collision(self, other: "entities.Entity") -> None:
         pass
+
+    state_format = "<d"
+
+    def get_state(self) -> Tuple[Any, ...]:
+        return (self.last_shot,)
+
+    def set_state(self, state: Tuple[Any, ...]) -> None:
+        self.last_shot, = state
@@ -1,26 +1,48 @@
 # To best share global variables across modules we put those inside a config
 # module. This module is then inported into every module that need access to its
 # variables There is only ever one instance of each module and so any changes
-# made to the module object, such as updating delta_time, get reflected
+# made to the module object, such as updating interpolation_alpha, get reflected
 # everywhere its references.
 
 SCREEN_WIDTH = 600
 SCREEN_HEIGHT = 800
 
-# As the game will run at the highest possible FPS allowed by hardware, actual
-# speed is hardware dependent. How quickly entities move around is determined by
-# how fast the game loop runs. So in order to do hardware independent physics
-# calculations, such as moving entities around, we need a value that increases
-# when the game is running slowly and decreases when game is running quickly.
-# This delta_time is then applied to every calculation in the game that does
-# something as a function of time. The net effect is that entities will move at
-# the same rate regardless of hardware speed, even though the movement might
-# sometimes be jittery. delta_time is updated each frame based on timing how
-# long it took for the frame to render compared to TARGET_TICKS_PER_SECOND.
-delta_time: float = 1
-
-# To calculate delta_time we need a target ticks per second at which delta_time
-# is 1. Here ticks refer to physics engine tick, but it could be anything such
-# as CPU ticks. In this game we update game state and redraws the frame every
-# second, making frames per second and ticks equal.
+# Game state is updated in fixed size steps, or ticks, of
+# 1/TARGET_TICKS_PER_SECOND seconds each, independently of how fast frames are
+# drawn. A fast computer draws several frames per tick, interpolating between
+# the previous and current tick's state, and a slow computer runs several ticks
+# per frame to catch up. Physics is therefore identical regardless of hardware
+# and its cost is predictable. The length of a tick is World.delta_time.
+
+# Ticks refer to physics engine ticks, i.e., game state updates per second.
 TARGET_TICKS_PER_SECOND = 60
+
+# Game time, in milliseconds, that passes per tick of delta_time 1.
+TICK_MS = 1000 / TARGET_TICKS_PER_SECOND
+
+# Upper bound on how many ticks to run before drawing the next frame. When a
+# computer is too slow to keep up, it would otherwise spend more and more time
+# catching up, never drawing a frame. Past the limit, the game slows down
+# instead.
+MAX_TICKS_PER_FRAME = 5
+
+# Frames drawn per second is capped by sleeping between frames rather than busy
+# waiting. Drawing faster than the display refreshes burns CPU for nothing. Set
+# to 0 to draw as fast as possible.
+MAX_FRAMES_PER_SECOND = 120
+
+# How far we are between the previous and the current tick, from 0 to 1, at the
+# time a frame is drawn. Used to interpolate entity positions for smooth motion
+# even when frames and ticks don't line up.
+interpolation_alpha: float = 1
+
+# Sprite atlas built by atlas.py, used in place of the files under sprites/
+# when present.
+ATLAS_FILE = "sprites.atlas"
+
+# Frames per second and whether it loops, for each animation sequence. Recorded
+# in the atlas index when it's built.
+SEQUENCES = {
+    "sprites/enemy/idle": (5, True),
+    "sprites/enemy/destroy": (15, False),
+}
@@ -0,0 +1,142 @@
+# Input reaches the game once per tick, as an immutable snapshot of the actions
+# held during the tick, rather than being read from SDL by components whenever
+# they like. Components ask whether an action, such as MOVE_LEFT, is held, and
+# never see keys or scancodes. Which keys trigger which action is decided by
+# the bindings of the keyboard input source.
+#
+# Where input comes from is up to an InputSource: the keyboard when playing, a
+# recording when replaying, a script or a random bot when testing, or packets
+# from a remote player. All of them are read once per tick. The game only ever
+# reacts to a handful of actions, so their state fits in a bitmask, which is
+# also what gets recorded.
+
+from abc import ABC, abstractmethod
+import random
+from typing import Dict, List, NamedTuple, Sequence, Tuple, TYPE_CHECKING
+import sdl2
+from helpers import sdl
+
+if TYPE_CHECKING:
+    from world import World
+
+# Actions the game reacts to. Bit i of an input mask is set when ACTIONS[i] is
+# held.
+ACTIONS: List[str] = ["move_left", "move_right", "fire"]
+MOVE_LEFT = 1 << 0
+MOVE_RIGHT = 1 << 1
+FIRE = 1 << 2
+ALL_ACTIONS = MOVE_LEFT | MOVE_RIGHT | FIRE
+
+# Action triggered by each key. Several keys may trigger the same action.
+BINDINGS: Dict[int, int] = {
+    sdl2.SDL_SCANCODE_LEFT: MOVE_LEFT,
+    sdl2.SDL_SCANCODE_RIGHT: MOVE_RIGHT,
+    sdl2.SDL_SCANCODE_SPACE: FIRE,
+}
+
+
+class Input(NamedTuple):
+    """Actions held during a tick."""
+    mask: int = 0
+
+    def held(self, action: int) -> bool:
+        return self.mask & action != 0
+
+    def names(self) -> List[str]:
+        return [name for bit, name in enumerate(ACTIONS) if self.mask >> bit & 1]
+
+
+class InputSource(ABC):
+    @abstractmethod
+    def read(self, tick: int) -> int:
+        """Returns the input mask for tick. Called once per tick, in order of
+        tick."""
+        raise NotImplementedError
+
+
+class KeyboardInput(InputSource):
+    """Keys currently held on the keyboard, mapped to actions by bindings.
+    SDL updates keyboard state while polling events, so events must have been
+    polled before reading."""
+
+    def __init__(self, bindings: Dict[int, int] = BINDINGS) -> None:
+        self.bindings = list(bindings.items())
+
+    def read(self, tick: int) -> int:
+        keys = sdl(sdl2.SDL_GetKeyboardState(None))
+        mask = 0
+        for scancode, action in self.bindings:
+            if keys[scancode]:
+                mask |= action
+        return mask
+
+
+class ScriptedInput(InputSource):
+    """Input mask of each tick given up front. Past the end of the script, no
+    actions are held, unless it loops."""
+
+    def __init__(self, masks: Sequence[int], loop: bool = False) -> None:
+        self.masks = masks
+        self.loop = loop
+
+    @classmethod
+    def from_runs(cls, runs: Sequence[Tuple[int, int]],
+                  loop: bool = False) -> "ScriptedInput":
+        """Script from (mask, ticks) pairs, each holding mask for a number of
+        ticks."""
+        masks = bytearray()
+        for mask, ticks in runs:
+            masks.extend(bytes([mask]) * ticks)
+        return cls(masks, loop)
+
+    def read(self, tick: int) -> int:
+        masks = self.masks
+        if self.loop and masks:
+            return masks[tick % len(masks)]
+        return masks[tick] if tick < len(masks) else 0
+
+
+class RandomInput(InputSource):
+    """Bot mashing random actions, for fuzzing and load testing. Like a
+    player, it holds each combination of actions for a while rather than
+    changing it every tick. The same seed gives the same input."""
+
+    def __init__(self, seed: int = 0, max_hold_ticks: int = 30) -> None:
+        self.random = random.Random(seed)
+        self.max_hold_ticks = max_hold_ticks
+        self.mask = 0
+        self.until = 0
+
+    def read(self, tick: int) -> int:
+        if tick >= self.until:
+            self.mask = self.random.randint(0, ALL_ACTIONS)
+            self.until = tick + self.random.randint(1, self.max_hold_ticks)
+        return self.mask
+
+
+class NetworkInput(InputSource):
+    """Input of a remote player, received per tick by whatever carries it.
+    Input that hasn't arrived in time is predicted by repeating the last mask
+    received, as held keys tend to stay held."""
+
+    def __init__(self) -> None:
+        self.received: Dict[int, int] = {}
+        self.mask = 0
+
+    def receive(self, tick: int, mask: int) -> None:
+        self.received[tick] = mask & ALL_ACTIONS
+
+    def read(self, tick: int) -> int:
+        mask = self.received.pop(tick, None)
+        if mask is not None:
+            self.mask = mask
+
+        # Input that arrived too late to be used is dropped.
+        for late in [t for t in self.received if t < tick]:
+            del self.received[late]
+        return self.mask
+
+
+def apply(world: "World", mask: int) -> None:
+    """Makes mask the world's input for the coming tick."""
+    world.input = Input(mask)
@@ -1,64 +1,178 @@
-from typing import List, Optional, Dict, Type
+from typing import List, Optional, Dict, Type, cast
 import sdl2
 import components
-from collision import Circle
+import controls
+from assets import Sequence_cache
+from collision import Circle, LAYER_NONE, LAYER_PLAYER, LAYER_ENEMY, LAYER_BULLET
 from helpers import Vec2f
+from pool import Pool
+from spritebatch import DRAW_LAYER_BULLET, DRAW_LAYER_ENEMY, DRAW_LAYER_PLAYER
+from world import World
 import config
 
 
 class Entity:
-    def __init__(self) -> None:
+    def __init__(self, world: World) -> None:
         # Stores only properties relevant to every Entity in the game.
         self.position = Vec2f(0, 0)
         self.rotation = 0.0
         self.active = False
-        self.components: List[components.Component] = []
 
-        # Since bullet, enemy, and player are all of type Entity, inside
-        # components we can't switch based on entity type. For instance, inside
-        # the vulnerable_to_bullets component, it would be vulnerable to any
-        # Entity, not just bullets. But assigning a tag to each Entity, we can
-        # use it in checks to make vulnerable_to_bullets only apply to enemies.
+        # Keyed by type, as there's at most one component of each type.
+        self.components: Dict[Type[components.Component],
+                              components.Component] = {}
+
+        # World the entity belongs to. It's only registered with the world,
+        # which indexes its components, while in play.
+        self.world = world
+        self.serial = len(world.owned)
+        world.owned.append(self)
+
+        # Pool the entity belongs to, if any, which deactivate() returns it to.
+        self.pool: Optional[Pool] = None
+
+        # State as of the previous tick. Frames drawn between ticks interpolate
+        # between previous and current state.
+        self.previous_position = Vec2f(0, 0)
+        self.previous_rotation = 0.0
+
+        # Since bullet, enemy, and player are all of type Entity, a tag names
+        # the kind of entity for debugging and tooling. Which entities interact
+        # on collision is decided by collision layers below, not by tags.
         self.tag = ""
 
         # Entity can have zero or more collision points defined as circles with
         # which is can collide with other entities' collision points.
         self.collisions: List[Circle] = []
 
+        # Collision layer the entity belongs to and mask of layers it collides
+        # with. See collision.LAYER_*.
+        self.layer = LAYER_NONE
+        self.mask = LAYER_NONE
+
+        # Layer the entity's sprite is drawn in. See spritebatch.DRAW_LAYER_*.
+        self.draw_layer = 0
+
+        # Components interested in collisions with each layer, built on
+        # demand.
+        self.collision_handlers: Dict[int, List[components.Component]] = {}
+
     def add_component(self, new: components.Component) -> None:
         """Adding a component gives the Entity the behavior of it. The new
         component must not share a type with any existing component in the
         Entity. As each component provides unique behavior, there's no reason
-        why we'd need the same behavior twice."""
-        for existing in self.components:
+        why we'd need the same behavior twice. While the entity is in play,
+        the component is only added when the world's commands are flushed."""
+        for existing in self.components.values():
             if isinstance(existing, type(new)):
                 raise Exception(type(new))
-        self.components.append(new)
+        if self in self.world.entities:
+            self.world.commands.add_component(self, new)
+        else:
+            self.attach_component(new)
+
+    def remove_component(self, klass: Type[components.Component]) -> None:
+        """While the entity is in play, the component is only removed when
+        the world's commands are flushed."""
+        if klass not in self.components:
+            raise Exception(klass)
+        if self in self.world.entities:
+            self.world.commands.remove_component(self, klass)
+        else:
+            self.detach_component(klass)
+
+    def attach_component(self, new: components.Component) -> None:
+        self.components[type(new)] = new
+        self.collision_handlers.clear()
+        if self in self.world.entities:
+            self.world.component_added(self, type(new))
+            new.added()
+
+    def detach_component(self, klass: Type[components.Component]) -> None:
+        component = self.components.pop(klass, None)
+        if component is None:
+            return
+        self.collision_handlers.clear()
+        if self in self.world.entities:
+            self.world.component_removed(self, klass)
+            component.removed()
 
     def get_component(self, klass: Type[components.Component]) -> components.Component:
-        for component in self.components:
+        component = self.components.get(klass)
+        if component is not None:
+            return component
+
+        # Fall back to a scan when asked for a base class.
+        for component in self.components.values():
             if isinstance(component, klass):
                 return component
         raise Exception(klass)
 
+    def deactivate(self) -> None:
+        """Takes the entity out of play, returning it to its pool. The entity
+        stays active until the world's commands are flushed."""
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            self.world.commands.activate(self, False)
+
+    def store_previous_state(self) -> None:
+        """Called before each tick, or after teleporting an entity to prevent
+        interpolating from where it was."""
+        self.previous_position.x = self.position.x
+        self.previous_position.y = self.position.y
+        self.previous_rotation = self.rotation
+
+    def interpolated_position(self) -> Vec2f:
+        alpha = config.interpolation_alpha
+        prev = self.previous_position
+        pos = self.position
+        return Vec2f(prev.x + (pos.x - prev.x) * alpha,
+                     prev.y + (pos.y - prev.y) * alpha)
+
+    def interpolated_rotation(self) -> float:
+        alpha = config.interpolation_alpha
+        return self.previous_rotation + \
+            (self.rotation - self.previous_rotation) * alpha
+
     # Implementing update(), draw(), and collision() sort of make Entity itself
     # a Component. At least if we consider it Entity and Component an
     # implementation of Composite design pattern.
     def update(self) -> None:
-        for component in self.components:
+        for component in self.components.values():
             component.update()
 
     def draw(self, renderer: sdl2.render.SDL_Renderer) -> None:
-        for component in self.components:
+        for component in self.components.values():
             component.draw(renderer)
 
+    def release(self) -> None:
+        for component in self.components.values():
+            component.release()
+
     def collision(self, other: "Entity") -> None:
-        for component in self.components:
+        """Routes the collision to only those components which registered
+        interest in other's layer through their collides_with."""
+        handlers = self.collision_handlers.get(other.layer)
+        if handlers is None:
+            handlers = [c for c in self.components.values()
+                        if c.collides_with & other.layer]
+            self.collision_handlers[other.layer] = handlers
+        for component in handlers:
             component.collision(other)
 
 # ------------------------------------------------------------------------------
 
 
+def new_entity(world: World) -> Entity:
+    if world.array_storage is not None:
+        from storage import ArrayEntity
+        return ArrayEntity(world)
+    return Entity(world)
+
+# ------------------------------------------------------------------------------
+
+
 # Ideally moves player x pixels every 1/60 second when left or right arrow key
 # is pressed. As the game will runs at the highest possible speed allowed by
 # hardware, actual speed is corrected by delta_time.
@@ -70,14 +184,14 @@ PLAYER_SIZE = 105
 Player_shot_cooldown = 250
 
 
-def create_player(renderer: sdl2.render.SDL_Renderer) -> Entity:
+def create_player(world: World,
+                  renderer: Optional[sdl2.render.SDL_Renderer]) -> Entity:
     """Creates a new player and attaches components to it."""
-    player = Entity()
-    player.position = Vec2f(
-        config.SCREEN_WIDTH / 2,
-        config.SCREEN_HEIGHT - PLAYER_SIZE / 2)
-    player.active = True
+    player = new_entity(world)
+    reset_player(player)
     player.tag = "player"
+    player.layer = LAYER_PLAYER
+    player.draw_layer = DRAW_LAYER_PLAYER
 
     sprite_renderer = components.SpriteRenderer(
         renderer, player, "sprites/player.bmp")
@@ -90,6 +204,17 @@ def create_player(renderer: sdl2.render.SDL_Renderer) -> Entity:
     player.add_component(keyboard_shooter)
     return player
 
+
+def reset_player(player: Entity) -> None:
+    player.position = Vec2f(
+        config.SCREEN_WIDTH / 2,
+        config.SCREEN_HEIGHT - PLAYER_SIZE / 2)
+    player.store_previous_state()
+    player.active = True
+    shooter = player.components.get(components.KeyboardShooter)
+    if shooter is not None:
+        cast(components.KeyboardShooter, shooter).last_shot = 0
+
 # ------------------------------------------------------------------------------
 
 
@@ -97,45 +222,52 @@ BULLET_SPEED = 10.0  # For visual effect, should be faster than player speed
 BULLET_SIZE = 8
 
 
-def create_bullet(renderer: sdl2.render.SDL_Renderer) -> Entity:
-    bullet = Entity()
+def create_bullet(world: World,
+                  renderer: Optional[sdl2.render.SDL_Renderer]) -> Entity:
+    bullet = new_entity(world)
     bullet.position = Vec2f(0, 0)
     bullet.active = False
     bullet.tag = "bullet"
+    bullet.layer = LAYER_BULLET
+    bullet.mask = LAYER_ENEMY
+    bullet.draw_layer = DRAW_LAYER_BULLET
 
     sprite_renderer = components.SpriteRenderer(
         renderer, bullet, "sprites/bullet.bmp")
     bullet.add_component(sprite_renderer)
 
-    bullet_mover = components.BulletMover(bullet, BULLET_SPEED)
-    bullet.add_component(bullet_mover)
-
+    # BulletMover needs to know the size of the bullet, so the collision
+    # circle goes first.
     collision = Circle(bullet.position, BULLET_SIZE)
     bullet.collisions.append(collision)
+
+    bullet_mover = components.BulletMover(bullet, BULLET_SPEED)
+    bullet.add_component(bullet_mover)
     return bullet
 
 
-Bullet_pool: List[Entity] = []
+# The pool grows when every bullet is in flight, such as when firing rapidly.
+BULLET_POOL_SIZE = 30
+BULLET_POOL_GROW_BY = 30
 
 
-def initialize_bullet_pool(renderer: sdl2.render.SDL_Renderer) -> None:
-    for _ in range(30):
-        bullet = create_bullet(renderer)
-        Entities.append(bullet)
-        Bullet_pool.append(bullet)
+def initialize_bullet_pool(world: World,
+                           renderer: Optional[sdl2.render.SDL_Renderer],
+                           size: int = BULLET_POOL_SIZE) -> None:
+    world.bullet_pool = Pool(world, lambda: create_bullet(world, renderer),
+                             size, grow_by=BULLET_POOL_GROW_BY)
 
 
-def bullet_from_pool() -> Optional[Entity]:
-    """Searches the bullet pool for an unused bullet and returns it. Any Entity
-    that needs to shoot a bullet will need to call this function to obtain one
-    and do whatever operation it needs on the bullet returned. Without the pool
-    we'd have to re-create a bullet every time its fired in the same way we
-    create player and enemies. But there's a lot more bullets than player and
-    enemy as the game is played."""
-    for bullet in Bullet_pool:
-        if not bullet.active:
-            return bullet
-    return None
+def bullet_from_pool(world: World) -> Optional[Entity]:
+    """Takes an unused bullet from the bullet pool and returns it activated.
+    Any Entity that needs to shoot a bullet will need to call this function to
+    obtain one and do whatever operation it needs on the bullet returned.
+    Without the pool we'd have to re-create a bullet every time its fired in
+    the same way we create player and enemies. But there's a lot more bullets
+    than player and enemy as the game is played."""
+    if world.bullet_pool is None:
+        return None
+    return world.bullet_pool.acquire()
 
 # ------------------------------------------------------------------------------
 
@@ -143,18 +275,24 @@ def bullet_from_pool() -> Optional[Entity]:
 ENEMY_SIZE = 105
 
 
-def create_enemy(renderer: sdl2.render.SDL_Renderer, position: Vec2f) -> Entity:
+def create_enemy(world: World, renderer: Optional[sdl2.render.SDL_Renderer],
+                 position: Vec2f) -> Entity:
     """Takes in position because unlike the player an enemy has no obvious default."""
-    enemy = Entity()
+    enemy = new_entity(world)
     enemy.position = position
     enemy.rotation = 180
     enemy.active = True
     enemy.tag = "enemy"
+    enemy.layer = LAYER_ENEMY
+    enemy.mask = LAYER_BULLET
+    enemy.draw_layer = DRAW_LAYER_ENEMY
 
-    idle_sequence = components.Sequence(
-        renderer, "sprites/enemy/idle", 5, True)
-    destroy_sequence = components.Sequence(
-        renderer, "sprites/enemy/destroy", 15, False)
+    # Sequences are shared by every enemy, so files are loaded only once.
+    idle_sequence = Sequence_cache.acquire(
+        renderer, "sprites/enemy/idle", *config.SEQUENCES["sprites/enemy/idle"])
+    destroy_sequence = Sequence_cache.acquire(
+        renderer, "sprites/enemy/destroy",
+        *config.SEQUENCES["sprites/enemy/destroy"])
 
     sequences: Dict[str, components.Sequence] = {
         "idle": idle_sequence,
@@ -174,9 +312,85 @@ def create_enemy(renderer: sdl2.render.SDL_Renderer, position: Vec2f) -> Entity:
 
     return enemy
 
+
+def reset_enemy(enemy: Entity) -> None:
+    animator = cast(components.Animator,
+                    enemy.get_component(components.Animator))
+    animator.set_sequence("idle")
+
+
+def initialize_enemy_pool(world: World,
+                          renderer: Optional[sdl2.render.SDL_Renderer],
+                          size: int, grow_by: int = 0) -> None:
+    world.enemy_pool = Pool(
+        world, lambda: create_enemy(world, renderer, Vec2f(0, 0)),
+        size, grow_by=grow_by, reset=reset_enemy)
+
+
+def enemy_from_pool(world: World, position: Vec2f) -> Optional[Entity]:
+    if world.enemy_pool is None:
+        return None
+    enemy = world.enemy_pool.acquire()
+    if enemy is not None:
+        # Collision circle holds on to the position object, so update it in
+        # place rather than assigning a new one.
+        enemy.position.x = position.x
+        enemy.position.y = position.y
+        enemy.store_previous_state()
+    return enemy
+
 # ------------------------------------------------------------------------------
 
 
-# From a threading perspective it's okay to make it a global variable. The game
-# is inherently single threaded.
-Entities: List[Entity] = []
+ENEMY_COLUMNS = 5
+ENEMY_ROWS = 3
+
+
+def create_game(world: World,
+                renderer: Optional[sdl2.render.SDL_Renderer]) -> None:
+    """Populates an empty world with the player and a formation of enemies."""
+    initialize_bullet_pool(world, renderer)
+    initialize_enemy_pool(world, renderer, ENEMY_COLUMNS * ENEMY_ROWS)
+    world.player = create_player(world, renderer)
+    world.add(world.player)
+    spawn_enemies(world)
+    world.commands.flush()
+
+
+def reset_game(world: World) -> None:
+    """Restores a world set up by create_game() to its initial state, reusing
+    its entities."""
+    for pool in (world.bullet_pool, world.enemy_pool):
+        if pool is not None:
+            for entity in pool.active():
+                pool.release(entity)
+    world.tick = 0
+    world.time_ms = 0
+    world.input = controls.Input()
+    if world.player is not None:
+        reset_player(world.player)
+    spawn_enemies(world)
+    world.commands.flush()
+
+
+def destroy_game(world: World) -> None:
+    """Takes every entity of a world out of play and destroys it, releasing
+    the textures and sequences it shares with other entities. Entities are
+    reused by their pools for as long as the world lives, so that's only once
+    the world is done with."""
+    world.commands.clear()
+    world.clear()
+    for entity in world.owned:
+        entity.release()
+    world.owned.clear()
+    world.player = None
+    world.bullet_pool = None
+    world.enemy_pool = None
+
+
+def spawn_enemies(world: World) -> None:
+    for i in range(ENEMY_COLUMNS):
+        for j in range(ENEMY_ROWS):
+            x = (i / ENEMY_COLUMNS) * config.SCREEN_WIDTH + (ENEMY_SIZE / 2)
+            y = j * ENEMY_SIZE + (ENEMY_SIZE / 2)
+            enemy_from_pool(world, Vec2f(x, y))
@@ -1,13 +1,77 @@
+import argparse
 import ctypes
+import hashlib
+import os
+import time
+from typing import Optional, Tuple
 import sdl2
-from helpers import sdl, Vec2f
+from helpers import sdl
+import controls
 import entities
-from collision import check_collisions
+import pipeline
+import replay
+import snapshot
+import systems
+from world import World
+from assets import Texture_cache
+from atlas import Atlas
+from metrics import Frame_metrics, Throttle
+from spritebatch import Sprite_batch
+from collision import set_broadphase, BROADPHASES
 from config import TARGET_TICKS_PER_SECOND, SCREEN_WIDTH, SCREEN_HEIGHT
 import config
 
 
-def start_system() -> None:
+def run_headless(world: World, ticks: int,
+                 source: Optional[controls.InputSource] = None) -> None:
+    """Runs the game for a number of ticks as fast as possible without a window
+    or renderer. Nothing is drawn, but game state is updated exactly as when
+    the game is played, with input from source, or without any input if it
+    isn't set."""
+
+    # Game time advances by a fixed amount per tick, so no SDL timer, display,
+    # or GPU is required.
+    entities.create_game(world, None)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        Frame_metrics.begin_frame()
+        if source is not None:
+            controls.apply(world, source.read(world.tick))
+        systems.run_tick(world)
+        Frame_metrics.end_frame()
+    elapsed = time.perf_counter() - start
+    print(f"{ticks} ticks in {elapsed:.3f} s "
+          f"({ticks / elapsed if elapsed > 0 else float('inf'):.0f} ticks/s)")
+
+
+def run_replay(filename: str, seek: Optional[int],
+               stop: Optional[int]) -> None:
+    """Replays a recorded game as fast as possible without a window or
+    renderer, from tick seek, if given, to tick stop or the end of the
+    recording. Prints a digest of the final state, which is the same every
+    time the recording is replayed. Storage is the one recorded with."""
+    recording = replay.load(filename)
+    world = replay.create_world(recording)
+    if seek is not None:
+        start = time.perf_counter()
+        replay.seek(world, recording, seek)
+        print(f"Seeked to tick {world.tick} in "
+              f"{time.perf_counter() - start:.3f} s")
+
+    first = world.tick
+    start = time.perf_counter()
+    replay.replay(world, recording, stop)
+    elapsed = time.perf_counter() - start
+    ticks = world.tick - first
+    print(f"Replayed {ticks} ticks in {elapsed:.3f} s "
+          f"({ticks / elapsed if elapsed > 0 else float('inf'):.0f} ticks/s)")
+    digest = hashlib.sha1(snapshot.save(world)).hexdigest()
+    print(f"State at tick {world.tick}: {digest}")
+    entities.destroy_game(world)
+
+
+def create_window() -> Tuple[sdl2.video.SDL_Window,
+                             sdl2.render.SDL_Renderer]:
     sdl(sdl2.SDL_Init(sdl2.SDL_INIT_EVERYTHING))
     window = sdl(sdl2.SDL_CreateWindow(
         b"Overwritten by game loop",
@@ -16,60 +80,259 @@ def start_system() -> None:
         sdl2.SDL_WINDOW_OPENGL))
     renderer = sdl(sdl2.SDL_CreateRenderer(
         window, -1, sdl2.SDL_RENDERER_ACCELERATED))
+    return window, renderer
 
-    entities.initialize_bullet_pool(renderer)
-    entities.Entities.append(entities.create_player(renderer))
 
-    for i in range(5):
-        for j in range(3):
-            x = (i / 5) * SCREEN_WIDTH + (entities.ENEMY_SIZE / 2)
-            y = j * entities.ENEMY_SIZE + \
-                (entities.ENEMY_SIZE / 2)
-            entities.Entities.append(
-                entities.create_enemy(renderer, Vec2f(x, y)))
+def run_interactive(world: World, recorder: Optional[replay.Recorder]) -> None:
+    """Runs the game in a window until it's closed. With recorder set, the
+    game is recorded."""
+    window, renderer = create_window()
+    entities.create_game(world, renderer)
 
+    keyboard = controls.KeyboardInput()
     event = sdl2.SDL_Event()
     running = True
+    tick_length = 1 / TARGET_TICKS_PER_SECOND
+    frequency = sdl2.SDL_GetPerformanceFrequency()
+    previous_time = sdl2.SDL_GetPerformanceCounter()
+
+    # Time not yet simulated. Each tick consumes tick_length of it.
+    accumulator = 0.0
+
+    # Updating the window title is itself costly, so only do it a few times
+    # per second.
+    title_throttle = Throttle(4)
+
     while running:
-        frame_start_time = sdl2.SDL_GetTicks()
-        while sdl(sdl2.SDL_PollEvent(ctypes.byref(event))) != 0:
-            if event.type == sdl2.SDL_QUIT:
-                running = False
-                break
+        frame_start_time = sdl2.SDL_GetPerformanceCounter()
+        accumulator += (frame_start_time - previous_time) / frequency
+        previous_time = frame_start_time
+        Frame_metrics.begin_frame()
+
+        with Frame_metrics.phase("events"):
+            while sdl(sdl2.SDL_PollEvent(ctypes.byref(event))) != 0:
+                if event.type == sdl2.SDL_QUIT:
+                    running = False
+                    break
 
-        sdl(sdl2.SDL_SetRenderDrawColor(renderer, 255, 255, 255, 255))
-        sdl(sdl2.SDL_RenderClear(renderer))
+        ticks = 0
+        while accumulator >= tick_length and \
+                ticks < config.MAX_TICKS_PER_FRAME:
+            mask = keyboard.read(world.tick)
+            if recorder is not None:
+                recorder.record(world, mask)
+            controls.apply(world, mask)
+            systems.run_tick(world)
+            accumulator -= tick_length
+            ticks += 1
 
-        # Start draw and update subsystem. In a naïve ECS implementation every
-        # system iterates through the complete list of entities. Below we
-        # operate on only the active subset of entities.
-        for entity in entities.Entities:
-            if entity.active:
-                entity.draw(renderer)
-                entity.update()
+        # Unable to keep up, so drop the time we didn't get to simulate. The
+        # game slows down, but keeps drawing frames.
+        if accumulator >= tick_length:
+            accumulator %= tick_length
+        config.interpolation_alpha = accumulator / tick_length
 
-        # Start collision subsystem
-        check_collisions()
-        sdl(sdl2.SDL_RenderPresent(renderer))
+        with Frame_metrics.phase("draw"):
+            sdl(sdl2.SDL_SetRenderDrawColor(renderer, 255, 255, 255, 255))
+            sdl(sdl2.SDL_RenderClear(renderer))
+
+            # Start draw subsystem. In a naïve ECS implementation every system
+            # iterates through the complete list of entities. Below we operate
+            # on only the active entities carrying a drawable component.
+            systems.draw(world, renderer)
+
+        with Frame_metrics.phase("present"):
+            sdl(sdl2.SDL_RenderPresent(renderer))
 
         # Add artificial wait to simulate running game on slow computer
         # sdl2.SDL_Delay(100)
 
-        # If we're running at half TARGET_TICKS_PER_SECOND, delta is 2. If we're
-        # running at double TARGET_TICKS_PER_SECOND, delta becomes 0.5.
-        frame_render_time = sdl2.SDL_GetTicks() - frame_start_time
-
-        # Alternatively, we could store just frame_render_time in delta_time and
-        # defer calculation below to each component.
-        config.delta_time = (frame_render_time / 1000) * \
-            TARGET_TICKS_PER_SECOND
+        Frame_metrics.end_frame()
+        frame_time = (sdl2.SDL_GetPerformanceCounter() -
+                      frame_start_time) / frequency
+        if title_throttle.ready():
+            if Frame_metrics.enabled:
+                title = f"Space Invaders - {Frame_metrics.overlay_text()}"
+            else:
+                title = (f"Space Invaders - Ticks: {ticks}, "
+                         f"Frame: {frame_time * 1000:.1f} ms, "
+                         f"Sprites: {Sprite_batch.drawn} drawn, "
+                         f"{Sprite_batch.culled} culled")
+            sdl2.SDL_SetWindowTitle(window, title.encode())
 
-        sdl2.SDL_SetWindowTitle(
-            window, f"""Space Invaders - Delta: {config.delta_time:.2f}, Render: {frame_render_time} ms""".encode())
+        # Sleep rather than spin until it's time for the next frame.
+        if config.MAX_FRAMES_PER_SECOND > 0:
+            remaining = 1 / config.MAX_FRAMES_PER_SECOND - frame_time
+            if remaining > 0:
+                sdl2.SDL_Delay(int(remaining * 1000))
 
+    entities.destroy_game(world)
+    Texture_cache.clear()
     sdl(sdl2.SDL_DestroyRenderer(renderer))
     sdl(sdl2.SDL_DestroyWindow(window))
 
 
+def run_pipelined(world: World, recorder: Optional[replay.Recorder]) -> None:
+    """Like run_interactive(), but with the game simulated on a thread of its
+    own while the main thread handles events and draws, see pipeline.py."""
+    window, renderer = create_window()
+    entities.create_game(world, renderer)
+
+    simulation = pipeline.Simulation(world, recorder)
+    keyboard = controls.KeyboardInput()
+    event = sdl2.SDL_Event()
+    running = True
+    frequency = sdl2.SDL_GetPerformanceFrequency()
+    title_throttle = Throttle(4)
+    previous_tick = 0
+
+    simulation.start()
+    try:
+        while running:
+            frame_start_time = sdl2.SDL_GetPerformanceCounter()
+            Frame_metrics.begin_frame()
+
+            # SDL wants events handled on the thread that created the window,
+            # so the keyboard is read here and handed to the simulation.
+            with Frame_metrics.phase("events"):
+                while sdl(sdl2.SDL_PollEvent(ctypes.byref(event))) != 0:
+                    if event.type == sdl2.SDL_QUIT:
+                        running = False
+                        break
+                simulation.mask = keyboard.read(world.tick)
+            if simulation.error is not None:
+                break
+
+            state, alpha = simulation.latest()
+            with Frame_metrics.phase("draw"):
+                sdl(sdl2.SDL_SetRenderDrawColor(renderer, 255, 255, 255, 255))
+                sdl(sdl2.SDL_RenderClear(renderer))
+                pipeline.draw(state, renderer, alpha)
+
+            with Frame_metrics.phase("present"):
+                sdl(sdl2.SDL_RenderPresent(renderer))
+
+            Frame_metrics.end_frame()
+            frame_time = (sdl2.SDL_GetPerformanceCounter() -
+                          frame_start_time) / frequency
+            if title_throttle.ready():
+                if Frame_metrics.enabled:
+                    title = f"Space Invaders - {Frame_metrics.overlay_text()}"
+                else:
+                    title = (f"Space Invaders - Pipelined, Tick: "
+                             f"{state.tick} "
+                             f"(+{state.tick - previous_tick}), "
+                             f"Frame: {frame_time * 1000:.1f} ms, "
+                             f"Sprites: {Sprite_batch.drawn} drawn, "
+                             f"{Sprite_batch.culled} culled")
+                    previous_tick = state.tick
+                sdl2.SDL_SetWindowTitle(window, title.encode())
+
+            if config.MAX_FRAMES_PER_SECOND > 0:
+                remaining = 1 / config.MAX_FRAMES_PER_SECOND - frame_time
+                if remaining > 0:
+                    sdl2.SDL_Delay(int(remaining * 1000))
+    finally:
+        simulation.stop()
+        entities.destroy_game(world)
+        Texture_cache.clear()
+        sdl(sdl2.SDL_DestroyRenderer(renderer))
+        sdl(sdl2.SDL_DestroyWindow(window))
+
+
+def start_system(broadphase: str = "spatial_hash",
+                 storage: str = "objects",
+                 headless_ticks: Optional[int] = None,
+                 metrics_file: Optional[str] = None,
+                 record_file: Optional[str] = None,
+                 replay_file: Optional[str] = None,
+                 seek: Optional[int] = None,
+                 stop: Optional[int] = None,
+                 bot_seed: Optional[int] = None,
+                 delta_time: float = 1,
+                 atlas_file: Optional[str] = config.ATLAS_FILE,
+                 pipelined: bool = False) -> None:
+    """With headless_ticks set, the game runs for that many ticks of length
+    delta_time without a window, played by a random bot if bot_seed is set.
+    With replay_file set, the recorded game is replayed without a window.
+    Otherwise it runs interactively until the window is closed, recorded to
+    record_file if set, with simulation and drawing on separate threads if
+    pipelined is set. With metrics_file set, frame metrics are written to it
+    on exit. Sprites come from atlas_file if it exists."""
+    set_broadphase(broadphase)
+    if atlas_file is not None and os.path.exists(atlas_file):
+        Texture_cache.use_atlas(Atlas(atlas_file))
+    world = World()
+    if storage == "numpy":
+        from storage import ArrayStorage
+        world.array_storage = ArrayStorage()
+    if headless_ticks is not None:
+        world.delta_time = delta_time
+        source = controls.RandomInput(bot_seed) \
+            if bot_seed is not None else None
+        run_headless(world, headless_ticks, source)
+        entities.destroy_game(world)
+    elif replay_file is not None:
+        run_replay(replay_file, seek, stop)
+    else:
+        recorder = replay.Recorder(world, record_file) if record_file else None
+        try:
+            if pipelined:
+                run_pipelined(world, recorder)
+            else:
+                run_interactive(world, recorder)
+        finally:
+            if recorder is not None:
+                recorder.close()
+    if metrics_file is not None:
+        Frame_metrics.dump(metrics_file)
+
+
 if __name__ == "__main__":
-    start_system()
+    parser = argparse.ArgumentParser(description="Space Invaders")
+    parser.add_argument("--broadphase", choices=sorted(BROADPHASES),
+                        default="spatial_hash",
+                        help="collision broadphase engine")
+    parser.add_argument("--storage", choices=["objects", "numpy"],
+                        default="objects",
+                        help="store entity state in Python objects or NumPy "
+                        "arrays")
+    parser.add_argument("--max-fps", type=int,
+                        default=config.MAX_FRAMES_PER_SECOND,
+                        help="cap on frames drawn per second, 0 for no cap")
+    parser.add_argument("--headless", type=int, metavar="TICKS",
+                        help="run TICKS ticks without window or renderer")
+    parser.add_argument("--bot", type=int, metavar="SEED",
+                        help="with --headless, play with random input seeded "
+                        "by SEED")
+    parser.add_argument("--delta-time", type=float, default=1,
+                        help="with --headless, length of a tick relative to "
+                        "the normal one, to fast-forward at coarser timesteps")
+    parser.add_argument("--no-atlas", action="store_true",
+                        help="load sprites from their files even if an atlas "
+                        "was built")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="simulate on a thread of its own while the main "
+                        "thread draws")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record the game's input to FILE")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="replay a recorded game without window or "
+                        "renderer")
+    parser.add_argument("--seek", type=int, metavar="TICK",
+                        help="start replaying from TICK")
+    parser.add_argument("--stop", type=int, metavar="TICK",
+                        help="stop replaying at TICK")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="collect frame metrics and write them to FILE, "
+                        "as JSON if it ends in .json and CSV otherwise")
+    parser.add_argument("--metrics-components", action="store_true",
+                        help="break down update time per component class")
+    args = parser.parse_args()
+    config.MAX_FRAMES_PER_SECOND = args.max_fps
+    Frame_metrics.enabled = args.metrics is not None
+    Frame_metrics.per_component = args.metrics_components
+    start_system(args.broadphase, args.storage, args.headless, args.metrics,
+                 args.record, args.replay, args.seek, args.stop, args.bot,
+                 args.delta_time, None if args.no_atlas else config.ATLAS_FILE,
+                 args.pipelined)
@@ -0,0 +1,203 @@
+# Lightweight instrumentation of the game loop. Each phase of a frame is timed
+# and the timings kept in ring buffers, so memory use stays constant however
+# long the game runs, and percentiles reflect recent frames only. Optionally,
+# time is broken down per component class. Compared to running the whole game
+# under cProfile, overhead is small enough to measure real load.
+#
+# Samples may be recorded from several threads, such as the simulation thread
+# of a pipelined game. Each thread accumulates its own, and hands them over to
+# the frame under a lock, all at once, so a tick's samples are never split
+# across frames or lost to end_frame() clearing them.
+
+import csv
+import json
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class RingBuffer:
+    """Holds the most recent capacity samples."""
+
+    def __init__(self, capacity: int) -> None:
+        self.samples = array("d", [0.0] * capacity)
+        self.capacity = capacity
+        self.count = 0
+
+    def add(self, sample: float) -> None:
+        self.samples[self.count % self.capacity] = sample
+        self.count += 1
+
+    def values(self) -> List[float]:
+        """Samples from oldest to newest."""
+        n = min(self.count, self.capacity)
+        start = self.count % self.capacity if self.count > self.capacity else 0
+        return [self.samples[(start + i) % self.capacity] for i in range(n)]
+
+    def percentile(self, p: float) -> float:
+        values = sorted(self.values())
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+class FrameMetrics:
+    def __init__(self, capacity: int = 3600) -> None:
+        # Disabled by default, making instrumentation close to free when not
+        # in use.
+        self.enabled = False
+        self.per_component = False
+        self.capacity = capacity
+        self.frames = 0
+        self.frame_times = RingBuffer(capacity)
+        self.phases: Dict[str, RingBuffer] = {}
+        self.components: Dict[str, RingBuffer] = {}
+        self.counters: Dict[str, RingBuffer] = {}
+
+        # Handed over during the current frame and moved into the ring
+        # buffers by end_frame(). Guarded by lock.
+        self.frame_start = 0.0
+        self.lock = threading.Lock()
+        self.current_phases: Dict[str, float] = {}
+        self.current_components: Dict[str, float] = {}
+        self.current_counters: Dict[str, int] = {}
+
+        # Phases, component times, and counters recorded by each thread and
+        # not yet handed over.
+        self.local = threading.local()
+
+    def begin_frame(self) -> None:
+        self.frame_start = time.perf_counter()
+
+    def pending(self) -> Tuple[Dict[str, float], Dict[str, float],
+                               Dict[str, int]]:
+        """Samples recorded by the calling thread since it last handed them
+        over."""
+        local = self.local
+        if not hasattr(local, "pending"):
+            local.pending = ({}, {}, {})
+        return local.pending
+
+    def hand_over(self) -> None:
+        """Adds the samples recorded by the calling thread to the current
+        frame. Threads other than the one ending frames call it whenever
+        they're done with a unit of work, such as a batch of ticks."""
+        if not self.enabled:
+            return
+        with self.lock:
+            for source, target in zip(self.pending(), (
+                    self.current_phases, self.current_components,
+                    self.current_counters)):
+                for name, value in source.items():
+                    target[name] = target.get(name, 0) + value
+                source.clear()
+
+    def end_frame(self) -> None:
+        if not self.enabled:
+            return
+        self.frame_times.add((time.perf_counter() - self.frame_start) * 1000)
+        self.hand_over()
+        with self.lock:
+            for source, target in ((self.current_phases, self.phases),
+                                   (self.current_components, self.components),
+                                   (self.current_counters, self.counters)):
+                # A phase may not run every frame, such as update when frames
+                # are drawn faster than ticks run, so keep buffers aligned by
+                # frame. Only as many frames as a buffer holds need filling
+                # in.
+                for name in source:
+                    if name not in target:
+                        target[name] = RingBuffer(self.capacity)
+                        for _ in range(min(self.frames, self.capacity)):
+                            target[name].add(0)
+                for name, buffer in target.items():
+                    buffer.add(source.get(name, 0))
+                source.clear()
+        self.frames += 1
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        yield
+        elapsed = (time.perf_counter() - start) * 1000
+        phases = self.pending()[0]
+        phases[name] = phases.get(name, 0) + elapsed
+
+    def add_component_time(self, name: str, seconds: float) -> None:
+        components = self.pending()[1]
+        components[name] = components.get(name, 0) + seconds * 1000
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.enabled:
+            counters = self.pending()[2]
+            counters[name] = counters.get(name, 0) + n
+
+    def summary(self) -> Dict[str, Any]:
+        def stats(buffer: RingBuffer) -> Dict[str, float]:
+            values = buffer.values()
+            return {
+                "mean": sum(values) / len(values) if values else 0.0,
+                "p50": buffer.percentile(50),
+                "p95": buffer.percentile(95),
+                "p99": buffer.percentile(99),
+            }
+        return {
+            "frames": self.frames,
+            "frame_ms": stats(self.frame_times),
+            "phases_ms": {n: stats(b) for n, b in self.phases.items()},
+            "components_ms": {n: stats(b) for n, b in self.components.items()},
+            "counters": {n: stats(b) for n, b in self.counters.items()},
+        }
+
+    def overlay_text(self) -> str:
+        frame = self.frame_times
+        phases = ", ".join(f"{name} {buffer.percentile(50):.1f}"
+                           for name, buffer in self.phases.items())
+        return (f"Frame p50/p95/p99: {frame.percentile(50):.1f}/"
+                f"{frame.percentile(95):.1f}/{frame.percentile(99):.1f} ms"
+                f" - {phases}")
+
+    def dump(self, filename: str) -> None:
+        """Writes per-frame samples to CSV or a summary plus samples to JSON,
+        depending on file extension."""
+        columns: Dict[str, RingBuffer] = {"frame_ms": self.frame_times}
+        columns.update({f"{n}_ms": b for n, b in self.phases.items()})
+        columns.update({f"{n}_ms": b for n, b in self.components.items()})
+        columns.update(self.counters)
+        values = {name: buffer.values() for name, buffer in columns.items()}
+        first = self.frames - len(values["frame_ms"])
+
+        if filename.endswith(".json"):
+            with open(filename, "w") as f:
+                json.dump({"summary": self.summary(),
+                           "first_frame": first,
+                           "frames": values}, f, indent=2)
+        else:
+            with open(filename, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["frame"] + list(values))
+                for i in range(len(values["frame_ms"])):
+                    writer.writerow([first + i] + [values[n][i] for n in values])
+
+
+class Throttle:
+    """Lets an action through at most rate times per second."""
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate
+        self.last: Optional[float] = None
+
+    def ready(self) -> bool:
+        now = time.perf_counter()
+        if self.last is None or now - self.last >= self.interval:
+            self.last = now
+            return True
+        return False
+
+
+Frame_metrics = FrameMetrics()
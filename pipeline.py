@@ -0,0 +1,143 @@
+# Pipelined execution. Played interactively, a frame polls events, runs
+# however many ticks are due, and then draws, one after another on one thread,
+# so simulation waits on SDL and SDL waits on simulation. Run pipelined, the
+# two are split into stages on separate threads:
+#
+#   Simulation thread  Runs ticks at the fixed rate and, after every batch of
+#                      ticks, captures what's to be drawn into a RenderSnapshot
+#   Main thread        Polls events, reads input, and draws the latest snapshot
+#
+# A RenderSnapshot holds, per sprite, its cached texture, draw layer, and its
+# previous and current position and rotation, so the main thread interpolates
+# between ticks without ever touching the world. Snapshots are immutable. The
+# simulation thread builds the next one while the main thread draws the one
+# published before, and publishing swaps a single reference. That's all the
+# synchronization needed, and neither stage ever waits on the other.
+#
+# SDL's render calls go through ctypes, which releases the GIL for the duration
+# of each call, so game logic runs while the renderer submits to the GPU.
+
+import threading
+import time
+from typing import List, NamedTuple, Optional, Tuple, TYPE_CHECKING
+import sdl2
+from assets import CachedTexture
+import controls
+from helpers import Vec2f
+from metrics import Frame_metrics
+from spritebatch import Sprite_batch
+import systems
+from world import World
+import config
+
+if TYPE_CHECKING:
+    import replay
+
+# Sprite, draw layer, previous x, y and rotation, and current x, y and
+# rotation.
+SpriteState = Tuple[CachedTexture, int, float, float, float, float, float,
+                    float]
+
+
+class RenderSnapshot(NamedTuple):
+    """What to draw after a tick. time is when, by time.perf_counter(), the
+    tick was due."""
+    tick: int
+    time: float
+    sprites: Tuple[SpriteState, ...]
+
+
+def capture(world: World, time_: float) -> RenderSnapshot:
+    sprites: List[SpriteState] = []
+    for component_type in systems.DRAW_ORDER:
+        for entity in world.query(component_type):
+            sprite = entity.components[component_type].current_sprite  # type: ignore
+            previous = entity.previous_position
+            position = entity.position
+            sprites.append((sprite, entity.draw_layer, previous.x, previous.y,
+                            entity.previous_rotation, position.x, position.y,
+                            entity.rotation))
+    return RenderSnapshot(world.tick, time_, tuple(sprites))
+
+
+def draw(snapshot: RenderSnapshot, renderer: sdl2.render.SDL_Renderer,
+         alpha: float) -> None:
+    """Draws snapshot, interpolated alpha of the way from the previous to the
+    current tick."""
+    position = Vec2f(0, 0)
+    for sprite, layer, previous_x, previous_y, previous_rotation, x, y, \
+            rotation in snapshot.sprites:
+        # The batch copies the position as the sprite is added, so the same
+        # object is reused for every sprite.
+        position.x = previous_x + (x - previous_x) * alpha
+        position.y = previous_y + (y - previous_y) * alpha
+        Sprite_batch.add(sprite, position,
+                         previous_rotation + (rotation - previous_rotation)
+                         * alpha, layer)
+    Sprite_batch.flush(renderer)
+
+
+class Simulation(threading.Thread):
+    """Runs world at the fixed tick rate until stopped, publishing a
+    RenderSnapshot after every batch of ticks. Input is whatever mask was last
+    set by the main thread. With recorder set, the game is recorded."""
+
+    def __init__(self, world: World,
+                 recorder: Optional["replay.Recorder"] = None) -> None:
+        super().__init__(name="simulation", daemon=True)
+        self.world = world
+        self.recorder = recorder
+        self.mask = 0
+        self.stopping = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.snapshot = capture(world, time.perf_counter())
+
+    def run(self) -> None:
+        try:
+            self.simulate()
+        except BaseException as error:  # pylint: disable=broad-except
+            # Raised again on the main thread by stop().
+            self.error = error
+
+    def simulate(self) -> None:
+        world = self.world
+        tick_length = 1 / config.TARGET_TICKS_PER_SECOND
+        next_tick = time.perf_counter()
+        while not self.stopping.is_set():
+            now = time.perf_counter()
+            if now < next_tick:
+                time.sleep(next_tick - now)
+                continue
+
+            ticks = 0
+            while now >= next_tick and ticks < config.MAX_TICKS_PER_FRAME:
+                mask = self.mask
+                if self.recorder is not None:
+                    self.recorder.record(world, mask)
+                controls.apply(world, mask)
+                systems.run_tick(world)
+                next_tick += tick_length
+                ticks += 1
+
+            # Unable to keep up, so drop the time we didn't get to simulate,
+            # like the single-threaded loop does.
+            if now >= next_tick:
+                next_tick = now + tick_length
+            self.snapshot = capture(world, next_tick - tick_length)
+
+            # Metrics of the ticks join whichever frame draws them.
+            Frame_metrics.hand_over()
+
+    def latest(self) -> Tuple[RenderSnapshot, float]:
+        """Most recently published snapshot, and how far between its previous
+        and current tick to draw it for it to move smoothly."""
+        snapshot = self.snapshot
+        tick_length = 1 / config.TARGET_TICKS_PER_SECOND
+        alpha = (time.perf_counter() - snapshot.time) / tick_length
+        return snapshot, min(max(alpha, 0.0), 1.0)
+
+    def stop(self) -> None:
+        self.stopping.set()
+        self.join()
+        if self.error is not None:
+            raise self.error
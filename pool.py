@@ -0,0 +1,96 @@
+from typing import Callable, Dict, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import entities
+    from world import World
+
+
+class Pool:
+    """Generic pool of entities of one archetype, such as bullets or enemies,
+    created by factory. Rather than creating an entity every time one is
+    needed, an idle one is taken from the pool and returned when it's no
+    longer in use.
+
+    Pooled entities are partitioned with active ones at the front and idle
+    ones, the free list, at the back. Acquiring and releasing an entity swaps
+    it across the boundary, which is O(1). Only active entities are part of
+    the world, so systems never visit idle ones."""
+
+    def __init__(self, world: "World", factory: Callable[[], "entities.Entity"],
+                 size: int, grow_by: int = 0, max_size: Optional[int] = None,
+                 reset: Optional[Callable[["entities.Entity"], None]] = None) -> None:
+        """When every entity is in use, the pool grows by grow_by entities, but
+        never beyond max_size. With grow_by 0, the pool has a fixed size.
+        reset, if given, is called on every entity acquired to restore it to
+        its initial state."""
+        self.world = world
+        self.factory = factory
+        self.grow_by = grow_by
+        self.max_size = max_size
+        self.reset = reset
+        self.entities: List["entities.Entity"] = []
+        self.slots: Dict["entities.Entity", int] = {}
+        self.active_count = 0
+
+        # Statistics for sizing the pool.
+        self.high_water_mark = 0
+        self.grows = 0
+        self.exhausted = 0
+
+        self.grow(size)
+
+    def grow(self, n: int) -> int:
+        if self.max_size is not None:
+            n = min(n, self.max_size - len(self.entities))
+        for _ in range(n):
+            entity = self.factory()
+            entity.active = False
+            entity.pool = self
+            self.slots[entity] = len(self.entities)
+            self.entities.append(entity)
+        return max(n, 0)
+
+    def acquire(self) -> Optional["entities.Entity"]:
+        """Returns an idle entity, or None if the pool is exhausted and not
+        allowed to grow. The entity enters play, active, when the world's
+        commands are next flushed, but is no longer idle right away."""
+        if self.active_count == len(self.entities):
+            if self.grow_by == 0 or self.grow(self.grow_by) == 0:
+                self.exhausted += 1
+                return None
+            self.grows += 1
+
+        entity = self.entities[self.active_count]
+        self.active_count += 1
+        self.high_water_mark = max(self.high_water_mark, self.active_count)
+        if self.reset is not None:
+            self.reset(entity)
+        self.world.commands.spawn(entity)
+        return entity
+
+    def release(self, entity: "entities.Entity") -> None:
+        """Returns entity to the pool. Releasing an idle entity does nothing.
+        The entity leaves play when the world's commands are next flushed."""
+        slot = self.slots[entity]
+        if slot >= self.active_count:
+            return
+
+        # Swap entity with the last active one, moving it to the idle side.
+        last = self.active_count - 1
+        other = self.entities[last]
+        self.entities[slot], self.entities[last] = other, entity
+        self.slots[other], self.slots[entity] = slot, last
+        self.active_count -= 1
+        self.world.commands.despawn(entity)
+
+    def active(self) -> List["entities.Entity"]:
+        return self.entities[:self.active_count]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self.entities),
+            "active": self.active_count,
+            "high_water_mark": self.high_water_mark,
+            "grows": self.grows,
+            "exhausted": self.exhausted,
+        }
@@ -0,0 +1,190 @@
+# Recording and replaying games. As game logic depends only on the input mask
+# of each tick and on game time, which advances by a fixed amount per tick,
+# replaying a game's inputs reproduces it exactly, at whatever speed the
+# computer allows. That turns a recorded session, such as one attached to a
+# bug report, into a reproducible regression or performance test case.
+#
+# A recording starts with a header, followed by chunks. Input chunks hold runs
+# of ticks with the same input mask, which keeps recordings small as keys are
+# typically held for many ticks at a time. Keyframe chunks hold a snapshot of
+# the world taken every keyframe_interval ticks, before that tick's input is
+# applied. Seeking to a tick restores the closest keyframe at or before it and
+# replays only the ticks since.
+
+import struct
+from typing import BinaryIO, Dict, Optional
+import controls
+import entities
+from metrics import Frame_metrics
+import snapshot
+import systems
+from world import World
+import config
+
+MAGIC = b"SIRL"
+VERSION = 2
+
+# Magic, version, ticks per second, keyframe interval, screen width and
+# height, and whether entities are kept in array storage. Games only replay
+# identically with the same settings. With array storage, bullets are returned
+# to their pool in a different order, which changes the order in which they're
+# reused.
+HEADER = struct.Struct("<4sBHIHH?")
+
+# Chunk tags, each followed by its struct. Keyframes are delta encoded
+# against the previous keyframe when their layouts match.
+INPUT = b"I"
+KEYFRAME = b"K"
+KEYFRAME_DELTA = b"D"
+
+# Input mask and number of consecutive ticks it's held.
+INPUT_RUN = struct.Struct("<BI")
+
+# Tick and length of the, possibly encoded, snapshot following.
+KEYFRAME_HEADER = struct.Struct("<QI")
+
+# Ten seconds of game time.
+KEYFRAME_INTERVAL = 10 * config.TARGET_TICKS_PER_SECOND
+
+
+class Recorder:
+    """Writes the input of every tick, and periodic keyframes, to a file as
+    the game is played."""
+
+    def __init__(self, world: World, filename: str,
+                 keyframe_interval: int = KEYFRAME_INTERVAL) -> None:
+        self.file: BinaryIO = open(filename, "wb")
+        self.keyframe_interval = keyframe_interval
+        self.file.write(HEADER.pack(
+            MAGIC, VERSION, config.TARGET_TICKS_PER_SECOND, keyframe_interval,
+            config.SCREEN_WIDTH, config.SCREEN_HEIGHT,
+            world.array_storage is not None))
+
+        # Current run of ticks with the same input mask, not yet written.
+        self.mask = 0
+        self.run = 0
+
+        self.snapshotter = snapshot.Snapshotter(world)
+        self.keyframe = b""
+
+    def record(self, world: World, mask: int) -> None:
+        """Called at the start of every tick, before mask is applied."""
+        if world.tick % self.keyframe_interval == 0:
+            self.flush()
+            keyframe = bytes(self.snapshotter.capture())
+            if len(keyframe) == len(self.keyframe):
+                tag = KEYFRAME_DELTA
+                data = snapshot.delta(self.keyframe, keyframe)
+            else:
+                tag = KEYFRAME
+                data = keyframe
+            self.file.write(tag + KEYFRAME_HEADER.pack(world.tick, len(data)))
+            self.file.write(data)
+            self.keyframe = keyframe
+
+        if mask != self.mask:
+            self.flush()
+            self.mask = mask
+        self.run += 1
+
+    def flush(self) -> None:
+        if self.run > 0:
+            self.file.write(INPUT + INPUT_RUN.pack(self.mask, self.run))
+            self.run = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+
+class Recording:
+    def __init__(self, keyframe_interval: int, array_storage: bool) -> None:
+        self.keyframe_interval = keyframe_interval
+        self.array_storage = array_storage
+
+        # Input mask per tick.
+        self.inputs = bytearray()
+
+        # Snapshot by tick it was taken at.
+        self.keyframes: Dict[int, bytes] = {}
+
+    def __len__(self) -> int:
+        return len(self.inputs)
+
+
+def load(filename: str) -> Recording:
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    magic, version, ticks_per_second, keyframe_interval, width, height, \
+        array_storage = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{filename} isn't a version {VERSION} recording")
+    if (ticks_per_second, width, height) != (
+            config.TARGET_TICKS_PER_SECOND, config.SCREEN_WIDTH,
+            config.SCREEN_HEIGHT):
+        raise ValueError(f"{filename} was recorded with different settings")
+
+    recording = Recording(keyframe_interval, array_storage)
+    offset = HEADER.size
+    previous = 0
+    while offset < len(data):
+        tag = data[offset:offset + 1]
+        offset += 1
+        if tag == INPUT:
+            mask, run = INPUT_RUN.unpack_from(data, offset)
+            offset += INPUT_RUN.size
+            recording.inputs.extend(bytes([mask]) * run)
+        elif tag in (KEYFRAME, KEYFRAME_DELTA):
+            tick, length = KEYFRAME_HEADER.unpack_from(data, offset)
+            offset += KEYFRAME_HEADER.size
+            keyframe = data[offset:offset + length]
+            if tag == KEYFRAME_DELTA:
+                keyframe = snapshot.undelta(
+                    recording.keyframes[previous], keyframe)
+            recording.keyframes[tick] = keyframe
+            previous = tick
+            offset += length
+        else:
+            raise ValueError(f"Unknown chunk {tag!r} at offset {offset - 1}")
+    return recording
+
+
+class RecordedInput(controls.ScriptedInput):
+    """Input of a recording. Past its end, no actions are held."""
+
+    def __init__(self, recording: Recording) -> None:
+        super().__init__(recording.inputs)
+
+
+def create_world(recording: Recording) -> World:
+    """Creates a world set up like the recorded one."""
+    world = World()
+    if recording.array_storage:
+        from storage import ArrayStorage
+        world.array_storage = ArrayStorage()
+    entities.create_game(world, None)
+    return world
+
+
+def seek(world: World, recording: Recording, tick: int) -> None:
+    """Brings world, created by create_world(), to the state it had at
+    tick, replaying from the closest keyframe. As snapshots can't remove
+    entities, world mustn't have grown beyond its size at the keyframe."""
+    keyframes = [k for k in recording.keyframes if k <= tick]
+    if keyframes:
+        snapshot.load(world, recording.keyframes[max(keyframes)])
+    replay(world, recording, tick)
+
+
+def replay(world: World, recording: Recording,
+           stop: Optional[int] = None) -> None:
+    """Runs world tick by tick, with the recorded input, until tick stop or the
+    end of the recording."""
+    source = RecordedInput(recording)
+    stop = len(recording) if stop is None else stop
+    while world.tick < stop:
+        Frame_metrics.begin_frame()
+        controls.apply(world, source.read(world.tick))
+        systems.run_tick(world)
+        Frame_metrics.end_frame()
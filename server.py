@@ -0,0 +1,493 @@
+# Authoritative game server. Every game lives in its own World, so a single
+# process can host many sessions at once. The server runs each session
+# headless at the fixed tick rate, takes the player's input over TCP, and
+# sends back what the player needs to draw:
+#
+#   $ python3 server.py --port 7777
+#
+# Each client connecting gets a session of its own. Messages are framed by
+# MESSAGE, a type and the length of what follows:
+#
+#   WELCOME  Server to client on connect: session id, ticks per second, and
+#            number of entity records in states to begin with
+#   INPUT    Client to server: tick the input is for, input mask, and the
+#            tick of the last state received, acknowledging it
+#   STATE    Server to client: tick, tick of the baseline state it's encoded
+#            against or -1 for none, followed by the encoded state
+#
+# Input goes through controls.NetworkInput, so input arriving late is
+# predicted by repeating the last mask received, and the simulation never
+# waits on the network.
+#
+# States are kept small. Rather than full snapshots, each state holds one fixed
+# size RECORD per entity, with position and rotation quantized to 16 bits. Each
+# state is delta encoded, with snapshot.delta(), against the latest state the
+# client acknowledged, so entities that didn't move cost next to nothing. Until
+# the client has acknowledged a state, states are encoded against all zeroes.
+# The whole playfield fits on screen, so every entity in play is sent by
+# default. With an interest distance set, only entities within it of the
+# player are filled in, and the rest are left zero.
+#
+# With --loopback N, the server is run along with N bot clients connecting to
+# it over the loopback interface, which stands in for real clients in tests
+# and measurements:
+#
+#   $ python3 server.py --loopback 64 --seconds 10
+#
+# Either way, the server reports bandwidth per client and how many sessions
+# one core could keep up with.
+
+import argparse
+import asyncio
+import itertools
+import struct
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import controls
+import entities
+import snapshot
+import systems
+from world import World
+import config
+
+# Message type and length of the message following.
+MESSAGE = struct.Struct("<BI")
+
+WELCOME = 1
+INPUT = 2
+STATE = 3
+
+# Session id, ticks per second, and records per state.
+WELCOME_BODY = struct.Struct("<IHI")
+
+# Tick the input is for, input mask, and tick of the last state received or
+# -1 for none.
+INPUT_BODY = struct.Struct("<QBq")
+
+# Longest message the server accepts. Clients only send INPUT, so anything
+# longer is a broken or hostile client, and it's disconnected before the
+# message is read.
+MAX_MESSAGE_SIZE = 64
+
+# Longest message clients accept. States grow with the pools, 9 bytes per
+# entity before encoding.
+MAX_STATE_MESSAGE_SIZE = 1 << 24
+
+# Tick and tick of the baseline, or -1 for none, followed by the encoded state.
+STATE_BODY = struct.Struct("<Qq")
+
+# Per entity: kind, or KIND_NONE if the entity isn't of interest, position
+# and rotation quantized, and for animated entities the sequence and frame
+# playing.
+RECORD = np.dtype([("kind", "u1"), ("x", "<u2"), ("y", "<u2"),
+                   ("rotation", "<u2"), ("sequence", "u1"), ("frame", "u1")])
+
+KIND_NONE = 0
+KIND_PLAYER = 1
+KIND_BULLET = 2
+KIND_ENEMY = 3
+
+# Positions are sent in steps of POSITION_QUANTUM pixels from POSITION_ORIGIN,
+# which covers the screen with room to spare, and rotations in steps of a
+# 65536th of a turn.
+POSITION_QUANTUM = 0.25
+POSITION_ORIGIN = -1024.0
+ROTATION_QUANTUM = 2 * np.pi / 65536
+
+# Ticks between states sent. Clients interpolate in between.
+SEND_INTERVAL = 2
+
+# How many ticks ahead of the latest state received clients send input, to
+# make up for latency.
+INPUT_LEAD = 2
+
+# States kept per client to encode against, which bounds how late an
+# acknowledgement may arrive and still be of use.
+HISTORY = 32
+
+# How far ahead of the session input may be for, in ticks. Input further
+# ahead is dropped rather than held on to.
+MAX_INPUT_AHEAD = 4 * config.TARGET_TICKS_PER_SECOND
+
+# Bytes queued for a client beyond which states aren't sent to it. Skipping
+# states is harmless, as each is encoded against one the client acknowledged,
+# but a client that stops reading for MAX_BACKED_UP states in a row is
+# disconnected.
+MAX_WRITE_BUFFER = 64 * 1024
+MAX_BACKED_UP = 5 * config.TARGET_TICKS_PER_SECOND // SEND_INTERVAL
+
+
+def quantize(world: World, interest_distance: Optional[float]) -> bytes:
+    """State of world as seen by its player, one RECORD per entity owned by
+    world. Without interest_distance, every entity in play is of interest."""
+    records = np.zeros(len(world.owned), dtype=RECORD)
+    player = world.player
+    if player is None:
+        return records.tobytes()
+    max_distance = interest_distance ** 2 if interest_distance is not None \
+        else float("inf")
+    px = player.position.x
+    py = player.position.y
+    bullets = world.bullet_pool
+    system = world.animations
+    slots = {animator.container: animator.slot
+             for animator in system.animators}
+    serials = []
+    kinds = []
+    positions = []
+    rotations = []
+    sequences = []
+    frames = []
+    for e in world.entities:
+        if not e.active:
+            continue
+        pos = e.position
+        dx = pos.x - px
+        dy = pos.y - py
+        if dx * dx + dy * dy > max_distance:
+            continue
+        serials.append(e.serial)
+        if e is player:
+            kinds.append(KIND_PLAYER)
+        elif bullets is not None and e.pool is bullets:
+            kinds.append(KIND_BULLET)
+        else:
+            kinds.append(KIND_ENEMY)
+        positions.append((pos.x, pos.y))
+        rotations.append(e.rotation)
+        slot = slots.get(e)
+        if slot is not None:
+            sequences.append(system.sequence_ids[slot])
+            frames.append(system.frames[slot])
+        else:
+            sequences.append(0)
+            frames.append(0)
+
+    if serials:
+        index = np.array(serials)
+        xy = np.rint((np.array(positions) - POSITION_ORIGIN) / POSITION_QUANTUM)
+        xy = np.clip(xy, 0, 65535)
+        records["kind"][index] = kinds
+        records["x"][index] = xy[:, 0]
+        records["y"][index] = xy[:, 1]
+        records["rotation"][index] = np.rint(
+            np.mod(rotations, 2 * np.pi) / ROTATION_QUANTUM).astype(np.int64) \
+            % 65536
+        records["sequence"][index] = sequences
+        records["frame"][index] = frames
+    return records.tobytes()
+
+
+def dequantize(state: bytes) -> np.ndarray:
+    """Entities of interest in a state, as an array of serial, kind, x, y,
+    rotation, sequence, and frame rows."""
+    records = np.frombuffer(state, dtype=RECORD)
+    serials = np.flatnonzero(records["kind"] != KIND_NONE)
+    visible = records[serials]
+    return np.column_stack([
+        serials, visible["kind"],
+        visible["x"] * POSITION_QUANTUM + POSITION_ORIGIN,
+        visible["y"] * POSITION_QUANTUM + POSITION_ORIGIN,
+        visible["rotation"] * ROTATION_QUANTUM,
+        visible["sequence"], visible["frame"]])
+
+
+def encode(baseline: Optional[bytes], state: bytes) -> bytes:
+    """Encodes state against baseline, or on its own if there's none. A state
+    XOR'ed with zeroes is itself, so that's simply compressing it."""
+    if baseline is None:
+        return zlib.compress(state, 1)
+    return snapshot.delta(baseline, state)
+
+
+def decode(baseline: Optional[bytes], encoded: bytes) -> bytes:
+    if baseline is None:
+        return zlib.decompress(encoded)
+    return snapshot.undelta(baseline, encoded)
+
+
+async def read_message(reader: asyncio.StreamReader,
+                       max_size: int = MAX_MESSAGE_SIZE) -> Tuple[int, bytes]:
+    """Reads the next message. Raises ValueError if it's longer than max_size,
+    without reading it."""
+    kind, length = MESSAGE.unpack(await reader.readexactly(MESSAGE.size))
+    if length > max_size:
+        raise ValueError(f"{length} byte message exceeds {max_size} bytes")
+    return kind, await reader.readexactly(length)
+
+
+def write_message(writer: asyncio.StreamWriter, kind: int,
+                  body: bytes) -> int:
+    """Queues a message and returns its size in bytes."""
+    writer.write(MESSAGE.pack(kind, len(body)) + body)
+    return MESSAGE.size + len(body)
+
+
+class Session:
+    """One game, played by the client connected through writer."""
+
+    def __init__(self, id_: int, writer: asyncio.StreamWriter,
+                 interest_distance: Optional[float]) -> None:
+        self.id = id_
+        self.writer = writer
+        self.interest_distance = interest_distance
+        self.world = World()
+        entities.create_game(self.world, None)
+        self.input = controls.NetworkInput()
+
+        # States sent and not yet known to be superseded, by tick, and the
+        # latest the client acknowledged.
+        self.sent: Dict[int, bytes] = {}
+        self.acknowledged = -1
+
+        # States in a row not sent as the client wasn't keeping up.
+        self.backed_up = 0
+
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def receive(self, body: bytes) -> None:
+        """Takes an INPUT message. Raises ValueError if it's malformed."""
+        self.bytes_received += MESSAGE.size + len(body)
+        if len(body) != INPUT_BODY.size:
+            raise ValueError(f"{len(body)} byte input, expected "
+                             f"{INPUT_BODY.size}")
+        tick, mask, acknowledged = INPUT_BODY.unpack(body)
+        if tick <= self.world.tick + MAX_INPUT_AHEAD:
+            self.input.receive(tick, mask)
+        if acknowledged > self.acknowledged and acknowledged in self.sent:
+            self.acknowledged = acknowledged
+            for old in [t for t in self.sent if t < acknowledged]:
+                del self.sent[old]
+
+    def tick(self) -> None:
+        world = self.world
+        controls.apply(world, self.input.read(world.tick))
+        systems.run_tick(world)
+
+    def send_state(self) -> None:
+        # A client not reading what's sent would have it queue up without
+        # bound.
+        if self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            self.backed_up += 1
+            # Closing would wait for the queue to be sent first.
+            if self.backed_up >= MAX_BACKED_UP:
+                self.writer.transport.abort()
+            return
+        self.backed_up = 0
+
+        world = self.world
+        state = quantize(world, self.interest_distance)
+        baseline = self.sent.get(self.acknowledged)
+
+        # Pools growing adds entities, and states of a different size can't be
+        # encoded against each other.
+        if baseline is not None and len(baseline) != len(state):
+            baseline = None
+        body = STATE_BODY.pack(world.tick,
+                               self.acknowledged if baseline is not None
+                               else -1) + encode(baseline, state)
+        self.bytes_sent += write_message(self.writer, STATE, body)
+        self.sent[world.tick] = state
+        if len(self.sent) > HISTORY:
+            del self.sent[min(self.sent)]
+
+
+class Server:
+    def __init__(self, interest_distance: Optional[float] = None) -> None:
+        self.interest_distance = interest_distance
+        self.sessions: Dict[int, Session] = {}
+        self.ids = itertools.count(1)
+        self.running = True
+
+        # For reporting. CPU time spent simulating and encoding, and totals of
+        # sessions that ended.
+        self.cpu_time = 0.0
+        self.ended_bytes_sent = 0
+        self.ended_bytes_received = 0
+        self.ended_seconds = 0.0
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        """Runs a session for as long as the client stays connected, and sends
+        valid messages."""
+        session = Session(next(self.ids), writer, self.interest_distance)
+        self.sessions[session.id] = session
+        started = time.perf_counter()
+        session.bytes_sent += write_message(writer, WELCOME, WELCOME_BODY.pack(
+            session.id, config.TARGET_TICKS_PER_SECOND,
+            len(session.world.owned)))
+        try:
+            while True:
+                kind, body = await read_message(reader)
+                if kind == INPUT:
+                    session.receive(body)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            del self.sessions[session.id]
+            entities.destroy_game(session.world)
+            self.ended_bytes_sent += session.bytes_sent
+            self.ended_bytes_received += session.bytes_received
+            self.ended_seconds += time.perf_counter() - started
+            writer.close()
+
+    async def run(self) -> None:
+        """Ticks every session at the fixed rate until stopped. Ticks are run
+        back to back to catch up when behind, like the game loop does, up to
+        config.MAX_TICKS_PER_FRAME at a time."""
+        tick_length = 1 / config.TARGET_TICKS_PER_SECOND
+        next_tick = time.perf_counter()
+        while self.running:
+            now = time.perf_counter()
+            if now < next_tick:
+                await asyncio.sleep(next_tick - now)
+                continue
+
+            start = time.process_time()
+            ticks = 0
+            while now >= next_tick and ticks < config.MAX_TICKS_PER_FRAME:
+                for session in list(self.sessions.values()):
+                    session.tick()
+                    if session.world.tick % SEND_INTERVAL == 0:
+                        session.send_state()
+                next_tick += tick_length
+                ticks += 1
+            if now >= next_tick:
+                next_tick = now + tick_length
+            self.cpu_time += time.process_time() - start
+
+            # Let connections send what was queued.
+            await asyncio.sleep(0)
+
+    def report(self, seconds: float) -> str:
+        """Bandwidth per client and sessions per core over the last
+        seconds."""
+        sessions = len(self.sessions)
+        sent = self.ended_bytes_sent + sum(
+            s.bytes_sent for s in self.sessions.values())
+        received = self.ended_bytes_received + sum(
+            s.bytes_received for s in self.sessions.values())
+        client_seconds = self.ended_seconds + seconds * sessions
+        busy = self.cpu_time / seconds if seconds > 0 else 0.0
+        per_core = sessions / busy if busy > 0 else float("inf")
+        if client_seconds > 0:
+            down = sent / client_seconds / 1024
+            up = received / client_seconds / 1024
+        else:
+            down = up = 0.0
+        return (f"{sessions} sessions, {busy * 100:.1f}% of a core "
+                f"({per_core:.0f} sessions per core), per client "
+                f"{down:.2f} KB/s down, {up:.2f} KB/s up")
+
+
+class Client:
+    """Client end of a session, decoding states as they arrive. Input to send
+    comes from source. Used by bots and tests in place of the game."""
+
+    def __init__(self, source: controls.InputSource) -> None:
+        self.source = source
+        self.session = 0
+        self.records = 0
+        self.states: Dict[int, bytes] = {}
+        self.latest = -1
+        self.bytes_received = 0
+
+    async def run(self, host: str, port: int,
+                  ticks: Optional[int] = None) -> None:
+        """Plays until the server disconnects, or until a state of tick ticks
+        or later is received."""
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while ticks is None or self.latest < ticks:
+                kind, body = await read_message(reader,
+                                                MAX_STATE_MESSAGE_SIZE)
+                self.bytes_received += MESSAGE.size + len(body)
+                if kind == WELCOME:
+                    self.session, _, self.records = WELCOME_BODY.unpack(body)
+                elif kind == STATE:
+                    self.receive_state(body)
+                    tick = self.latest + INPUT_LEAD
+                    write_message(writer, INPUT, INPUT_BODY.pack(
+                        tick, self.source.read(tick), self.latest))
+                    await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    def receive_state(self, body: bytes) -> None:
+        tick, baseline = STATE_BODY.unpack_from(body)
+        state = decode(self.states[baseline] if baseline >= 0 else None,
+                       body[STATE_BODY.size:])
+        self.states[tick] = state
+        self.latest = max(self.latest, tick)
+        for old in [t for t in self.states if t < baseline]:
+            del self.states[old]
+
+    def entities(self) -> np.ndarray:
+        """Entities of interest in the latest state, see dequantize()."""
+        return dequantize(self.states[self.latest])
+
+
+async def serve(host: str, port: int, interest_distance: Optional[float],
+                seconds: Optional[float], loopback: int,
+                report_interval: float) -> None:
+    server = Server(interest_distance)
+    listener = await asyncio.start_server(server.handle, host, port)
+    port = listener.sockets[0].getsockname()[1]
+    print(f"Serving on {host}:{port}")
+    ticker = asyncio.ensure_future(server.run())
+
+    # Bots connecting over the loopback interface.
+    clients: List[asyncio.Future] = [
+        asyncio.ensure_future(Client(controls.RandomInput(seed)).run(
+            "127.0.0.1", port))
+        for seed in range(loopback)]
+
+    start = time.perf_counter()
+    last = start
+    try:
+        while seconds is None or time.perf_counter() - start < seconds:
+            await asyncio.sleep(min(report_interval,
+                                    seconds - (time.perf_counter() - start))
+                                if seconds is not None else report_interval)
+            now = time.perf_counter()
+            print(server.report(now - last))
+            server.cpu_time = 0.0
+            server.ended_bytes_sent = server.ended_bytes_received = 0
+            server.ended_seconds = 0.0
+            for session in server.sessions.values():
+                session.bytes_sent = session.bytes_received = 0
+            last = now
+    finally:
+        server.running = False
+        await ticker
+        for client in clients:
+            client.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+        listener.close()
+        await listener.wait_closed()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Space Invaders authoritative game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777,
+                        help="port to listen on, 0 for any free port")
+    parser.add_argument("--interest", type=float,
+                        help="distance from the player within which entities "
+                        "are sent, by default every entity is")
+    parser.add_argument("--loopback", type=int, default=0, metavar="N",
+                        help="connect N bot clients over the loopback "
+                        "interface")
+    parser.add_argument("--seconds", type=float,
+                        help="stop after this many seconds")
+    parser.add_argument("--report-interval", type=float, default=5,
+                        help="seconds between reports of bandwidth and load")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.interest, args.seconds,
+                      args.loopback, args.report_interval))
@@ -0,0 +1,253 @@
+# Snapshots capture the complete state of a world as bytes, from which the
+# world can later be restored. Only state which changes during a game is
+# captured. Which components an entity has, its sprites, or collision circles
+# are set up identically every time a world is created by
+# entities.create_game(), so restoring a snapshot requires a world created the
+# same way. Circles are centered on their entity's position object, which is
+# updated in place, so they follow along. Entities are identified by their
+# serial, their position in World.owned.
+#
+# Snapshots have a fixed layout, decided by the world's entities and the
+# components they carry. Every entity's state is a fixed size record at a
+# fixed offset, packed and unpacked by a single precompiled struct. As long as
+# no entities are created, every snapshot of a world has the same size and
+# layout. A Snapshotter then writes snapshots into the same preallocated
+# buffer over and over, and successive snapshots can be delta encoded byte by
+# byte. That keeps taking a snapshot every tick, such as for rollback, cheap.
+#
+# Layout:
+#
+#   WORLD header
+#   Pool of each entity, one byte per entity
+#   ENTITY record of each entity, followed by the state of its components
+#   Number of entities in play, followed by their serials in order, with room
+#   for every entity
+#   POOL header of each pool, followed by serials of its entities in
+#   partition order
+
+import struct
+import zlib
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from pool import Pool
+from world import World
+
+# Tick, game time, delta_time, and number of entities.
+WORLD = struct.Struct("<QddI")
+
+# Active flag, position, rotation, previous position, and previous rotation.
+ENTITY_FORMAT = "?dddddd"
+ENTITY_FIELDS = 7
+
+# Pool size and number of entities in use.
+POOL = struct.Struct("<II")
+
+COUNT = struct.Struct("<I")
+
+
+def pools(world: World) -> List[Optional[Pool]]:
+    return [world.bullet_pool, world.enemy_pool]
+
+
+def field_count(fmt: str) -> int:
+    return len(struct.unpack("<" + fmt, bytes(struct.calcsize("<" + fmt))))
+
+
+class Layout:
+    """Where everything goes in snapshots of world in its current shape."""
+
+    def __init__(self, world: World) -> None:
+        self.count = len(world.owned)
+        self.pool_sizes = [len(p.entities) if p is not None else 0
+                           for p in pools(world)]
+
+        # One struct per distinct set of component formats, which in practice
+        # means one per kind of entity.
+        structs: Dict[str, struct.Struct] = {}
+        self.records: List[Tuple[int, struct.Struct, List[Tuple[int, int]]]] = []
+        offset = WORLD.size + self.count
+        for e in world.owned:
+            formats = [c.state_format.lstrip("<")
+                       for c in e.components.values()]
+            fmt = "<" + ENTITY_FORMAT + "".join(formats)
+            record = structs.get(fmt)
+            if record is None:
+                record = structs[fmt] = struct.Struct(fmt)
+
+            # Slice of the record's fields for each component, empty for
+            # stateless ones.
+            fields = []
+            start = ENTITY_FIELDS
+            for component_format in formats:
+                end = start + field_count(component_format)
+                fields.append((start, end))
+                start = end
+            self.records.append((offset, record, fields))
+            offset += record.size
+
+        self.entities_offset = offset
+        offset += COUNT.size + 4 * self.count
+        self.pool_offsets = []
+        for size in self.pool_sizes:
+            self.pool_offsets.append(offset)
+            offset += POOL.size + 4 * size
+        self.size = offset
+
+    def matches(self, world: World) -> bool:
+        return self.count == len(world.owned) and self.pool_sizes == [
+            len(p.entities) if p is not None else 0 for p in pools(world)]
+
+
+class Snapshotter:
+    """Takes snapshots of world into a buffer allocated once and reused for
+    as long as the world doesn't grow."""
+
+    def __init__(self, world: World) -> None:
+        self.world = world
+        self.layout = Layout(world)
+        self.buffer = self.allocate()
+
+    def allocate(self) -> bytearray:
+        buffer = bytearray(self.layout.size)
+
+        # Entities never change pool, so the pool of each entity is written
+        # only once.
+        world_pools = pools(self.world)
+        for serial, e in enumerate(self.world.owned):
+            buffer[WORLD.size + serial] = \
+                world_pools.index(e.pool) + 1 if e.pool is not None else 0
+        return buffer
+
+    def capture(self) -> memoryview:
+        """Returns a view of the buffer holding the snapshot, which is only
+        valid until the next capture."""
+        world = self.world
+        layout = self.layout
+        if not layout.matches(world):
+            layout = self.layout = Layout(world)
+            self.buffer = self.allocate()
+        buffer = self.buffer
+
+        WORLD.pack_into(buffer, 0, world.tick, world.time_ms,
+                        world.delta_time, layout.count)
+        for e, (offset, record, _) in zip(world.owned, layout.records):
+            position = e.position
+            previous = e.previous_position
+            values = [e.active, position.x, position.y, e.rotation,
+                      previous.x, previous.y, e.previous_rotation]
+            for c in e.components.values():
+                if c.state_format:
+                    values.extend(c.get_state())
+            record.pack_into(buffer, offset, *values)
+
+        # Order of entities in play decides the order in which they're updated
+        # and collide, so it's part of the state.
+        offset = layout.entities_offset
+        COUNT.pack_into(buffer, offset, len(world.entities))
+        serials = np.frombuffer(buffer, dtype="<u4", count=layout.count,
+                                offset=offset + COUNT.size)
+        serials[:len(world.entities)] = [e.serial for e in world.entities]
+        serials[len(world.entities):] = 0
+
+        for pool, size, offset in zip(pools(world), layout.pool_sizes,
+                                      layout.pool_offsets):
+            if pool is None:
+                POOL.pack_into(buffer, offset, 0, 0)
+                continue
+            POOL.pack_into(buffer, offset, size, pool.active_count)
+            serials = np.frombuffer(buffer, dtype="<u4", count=size,
+                                    offset=offset + POOL.size)
+            serials[:] = [e.serial for e in pool.entities]
+        return memoryview(buffer)
+
+    def restore(self, data: bytes) -> None:
+        """Restores world to the state captured in data. Pools grow as
+        needed, but world mustn't have more entities than when the snapshot
+        was taken. Entity state is written into existing objects, so besides
+        growing pools, nothing is created per entity."""
+        world = self.world
+        world.commands.clear()
+        world.tick, world.time_ms, world.delta_time, count = \
+            WORLD.unpack_from(data, 0)
+        if count < len(world.owned):
+            raise ValueError(f"Snapshot has {count} entities, world has "
+                             f"{len(world.owned)}")
+
+        world_pools = pools(world)
+        for serial in range(len(world.owned), count):
+            # Created after the world, when the pool grew, so grow it the same
+            # way. Entities are created in order of serial, so each new entity
+            # gets the serial it had.
+            pool = data[WORLD.size + serial]
+            owner = world_pools[pool - 1] if pool > 0 else None
+            if owner is None:
+                raise ValueError(f"Entity {serial} isn't in a pool")
+            owner.grow(1)
+
+        layout = self.layout
+        if not layout.matches(world):
+            layout = self.layout = Layout(world)
+            self.buffer = self.allocate()
+        if len(data) != layout.size:
+            raise ValueError(f"Snapshot is {len(data)} bytes, expected "
+                             f"{layout.size}")
+
+        for e, (offset, record, fields) in zip(world.owned, layout.records):
+            values = record.unpack_from(data, offset)
+            e.active = values[0]
+            e.position.x = values[1]
+            e.position.y = values[2]
+            e.rotation = values[3]
+            e.previous_position.x = values[4]
+            e.previous_position.y = values[5]
+            e.previous_rotation = values[6]
+            for c, (start, end) in zip(e.components.values(), fields):
+                if c.state_format:
+                    c.set_state(values[start:end])
+
+        offset = layout.entities_offset
+        n, = COUNT.unpack_from(data, offset)
+        serials = np.frombuffer(data, dtype="<u4", count=n,
+                                offset=offset + COUNT.size).tolist()
+        world.clear()
+        owned = world.owned
+        for serial in serials:
+            world.add(owned[serial])
+
+        for pool, offset in zip(world_pools, layout.pool_offsets):
+            size, active_count = POOL.unpack_from(data, offset)
+            if pool is None:
+                continue
+            serials = np.frombuffer(data, dtype="<u4", count=size,
+                                    offset=offset + POOL.size).tolist()
+            pool.entities = [owned[serial] for serial in serials]
+            pool.slots = {e: slot for slot, e in enumerate(pool.entities)}
+            pool.active_count = active_count
+
+
+def save(world: World) -> bytes:
+    return bytes(Snapshotter(world).capture())
+
+
+def load(world: World, data: bytes) -> None:
+    Snapshotter(world).restore(data)
+
+
+# Between successive snapshots of the same layout, most bytes don't change.
+# XOR'ing one snapshot with the previous zeroes those bytes, and runs of zeroes
+# compress to next to nothing.
+
+def delta(previous: bytes, current: bytes) -> bytes:
+    """Encodes current relative to previous, which must be the same size."""
+    if len(previous) != len(current):
+        raise ValueError("Snapshots differ in layout")
+    changes = np.bitwise_xor(np.frombuffer(previous, dtype=np.uint8),
+                             np.frombuffer(current, dtype=np.uint8))
+    return zlib.compress(changes.tobytes(), 1)
+
+
+def undelta(previous: bytes, encoded: bytes) -> bytes:
+    """Decodes a snapshot encoded by delta() relative to previous."""
+    changes = np.frombuffer(zlib.decompress(encoded), dtype=np.uint8)
+    return np.bitwise_xor(np.frombuffer(previous, dtype=np.uint8),
+                          changes).tobytes()
@@ -0,0 +1,201 @@
+# Drawing a sprite used to involve querying the texture for its size and
+# allocating rectangles, a point, and pointers on every call. Instead, sprites
+# are now added to a batch during the draw subsystem and submitted once per
+# frame, grouped by texture. Sizes come from the texture cache and rectangles
+# live in buffers allocated once and reused across frames.
+#
+# The batch is the frame's draw list. Sprites entirely outside the viewport
+# are culled as they're added, and the rest are submitted sorted by draw layer
+# and then grouped by texture, so the renderer switches textures as rarely as
+# layering allows. With an atlas in use, every sprite shares one texture, so
+# each layer is a single group.
+
+import ctypes
+import math
+from typing import Dict, List, Tuple
+import sdl2
+from assets import CachedTexture
+from helpers import sdl, Vec2f
+from metrics import Frame_metrics
+import config
+
+# Available from SDL 2.0.18. Allows every sprite sharing a texture to be
+# submitted in a single call rather than one call per sprite. pysdl2 binds
+# functions missing from an older library to stubs raising when called, so
+# it's the version of the library loaded that tells.
+HAS_RENDER_GEOMETRY = sdl2.dll.version >= 2018
+
+# Draw layers. Sprites in higher layers are drawn on top of those in lower ones.
+DRAW_LAYER_ENEMY = 0
+DRAW_LAYER_PLAYER = 1
+DRAW_LAYER_BULLET = 2
+
+
+class SpriteBatch:
+    def __init__(self, capacity: int = 256,
+                 use_geometry: bool = HAS_RENDER_GEOMETRY) -> None:
+        """Without use_geometry, sprites are submitted one SDL_RenderCopyEx()
+        call at a time."""
+        self.capacity = 0
+        self.count = 0
+        self.use_geometry = use_geometry
+        self.sprites: List[CachedTexture] = []
+
+        # Indices of sprites added per draw layer and texture, in order of
+        # first use. Draw order is preserved among sprites sharing a texture.
+        self.groups: Dict[Tuple[int, int], List[int]] = {}
+        self.grow(capacity)
+
+        # Area of the playfield visible on screen, in playfield coordinates.
+        # Moving it scrolls the playfield.
+        self.view_x = 0.0
+        self.view_y = 0.0
+        self.view_width = float(config.SCREEN_WIDTH)
+        self.view_height = float(config.SCREEN_HEIGHT)
+
+        # Sprites culled so far this frame, and sprites drawn and culled the
+        # previous frame.
+        self.culling = 0
+        self.drawn = 0
+        self.culled = 0
+
+    def grow(self, capacity: int) -> None:
+        rects = (sdl2.SDL_Rect * capacity)()
+        angles = (ctypes.c_double * capacity)()
+        if self.capacity > 0:
+            ctypes.memmove(rects, self.rects,
+                           self.capacity * ctypes.sizeof(sdl2.SDL_Rect))
+            ctypes.memmove(angles, self.angles,
+                           self.capacity * ctypes.sizeof(ctypes.c_double))
+        self.rects = rects
+        self.angles = angles
+        self.capacity = capacity
+
+        # Python objects viewing each rectangle and pointers to them are
+        # created once here rather than on every draw.
+        self.rect_views = list(rects)
+        self.rect_pointers = [ctypes.pointer(rect) for rect in self.rect_views]
+        if self.use_geometry:
+            self.vertices = (sdl2.SDL_Vertex * (4 * capacity))()
+            for vertex in self.vertices:
+                vertex.color = sdl2.SDL_Color(255, 255, 255, 255)
+
+            # Two triangles per sprite, covering the four vertices.
+            self.indices = (ctypes.c_int * (6 * capacity))()
+            for i in range(capacity):
+                self.indices[6 * i:6 * i + 6] = [
+                    4 * i, 4 * i + 1, 4 * i + 2,
+                    4 * i + 2, 4 * i + 3, 4 * i]
+
+    def add(self, sprite: CachedTexture, position: Vec2f, rotation: float,
+            layer: int = 0) -> None:
+        """Queues sprite to be drawn with its pivot on position and rotated by
+        rotation degrees around its pivot, in draw layer layer. Nothing is
+        queued if the sprite is outside the viewport."""
+        texture = sprite.texture
+        if texture is None:
+            return
+
+        x = position.x - self.view_x
+        y = position.y - self.view_y
+        reach = sprite.reach
+        if x + reach < 0 or x - reach > self.view_width or \
+                y + reach < 0 or y - reach > self.view_height:
+            self.culling += 1
+            return
+
+        if self.count == self.capacity:
+            self.grow(2 * self.capacity)
+
+        i = self.count
+        rect = self.rect_views[i]
+
+        # Transforms coordinates to the pivot of the sprite, usually its
+        # center, rather than default upper left corner. This makes centering
+        # the sprite on screen easier.
+        rect.x = int(x - sprite.pivot_x)
+        rect.y = int(y - sprite.pivot_y)
+        rect.w = int(sprite.width)
+        rect.h = int(sprite.height)
+        self.angles[i] = rotation
+        self.sprites.append(sprite)
+        key = (layer, id(texture))
+        if key in self.groups:
+            self.groups[key].append(i)
+        else:
+            self.groups[key] = [i]
+        self.count += 1
+
+    def flush(self, renderer: sdl2.render.SDL_Renderer) -> None:
+        """Submits every queued sprite and empties the batch."""
+        # Sorting is stable, so within a layer textures stay in order of first
+        # use.
+        for key in sorted(self.groups, key=lambda key: key[0]):
+            indices = self.groups[key]
+            texture = self.sprites[indices[0]].texture
+            if self.use_geometry:
+                self.submit_geometry(renderer, texture, indices)
+            else:
+                self.submit_copies(renderer, texture, indices)
+
+        self.drawn = self.count
+        self.culled = self.culling
+        Frame_metrics.count("sprites_drawn", self.drawn)
+        Frame_metrics.count("sprites_culled", self.culled)
+        self.culling = 0
+        self.count = 0
+        self.sprites.clear()
+        self.groups.clear()
+
+    def submit_copies(self, renderer: sdl2.render.SDL_Renderer,
+                      texture: sdl2.render.SDL_Texture,
+                      indices: List[int]) -> None:
+        pointers = self.rect_pointers
+        angles = self.angles
+        copy = sdl2.SDL_RenderCopyEx
+        flip = sdl2.SDL_FLIP_NONE
+        sprites = self.sprites
+        for i in indices:
+            # With no source rectangle the whole texture is drawn, and with no
+            # center point rotation happens around the destination's center.
+            sprite = sprites[i]
+            sdl(copy(renderer, texture, sprite.source, pointers[i], angles[i],
+                     sprite.center, flip))
+
+    def submit_geometry(self, renderer: sdl2.render.SDL_Renderer,
+                        texture: sdl2.render.SDL_Texture,
+                        indices: List[int]) -> None:
+        vertices = self.vertices
+        n = 0
+        sprites = self.sprites
+        for i in indices:
+            rect = self.rect_views[i]
+            sprite = sprites[i]
+            left = -sprite.pivot_x
+            top = -sprite.pivot_y
+            right = left + rect.w
+            bottom = top + rect.h
+            cx = rect.x + sprite.pivot_x
+            cy = rect.y + sprite.pivot_y
+            u0, v0, u1, v1 = sprite.uv
+            radians = math.radians(self.angles[i])
+            cos = math.cos(radians)
+            sin = math.sin(radians)
+
+            # Corners clockwise from upper left, rotated around the pivot
+            # like SDL_RenderCopyEx() does.
+            for dx, dy, u, v in ((left, top, u0, v0),
+                                 (right, top, u1, v0),
+                                 (right, bottom, u1, v1),
+                                 (left, bottom, u0, v1)):
+                vertex = vertices[n]
+                vertex.position.x = cx + dx * cos - dy * sin
+                vertex.position.y = cy + dx * sin + dy * cos
+                vertex.tex_coord.x = u
+                vertex.tex_coord.y = v
+                n += 1
+        sdl(sdl2.SDL_RenderGeometry(renderer, texture, vertices, n,
+                                    self.indices, n // 4 * 6))
+
+
+Sprite_batch = SpriteBatch()
@@ -0,0 +1,229 @@
+# Optional struct-of-arrays storage for the state every Entity has in common.
+# Instead of each Entity holding its own Vec2f, rotation, and active flag as
+# separate Python objects, the values live in contiguous NumPy arrays indexed by
+# entity id. Individual entities still read and write their state through the
+# usual attributes, but systems can now operate on all entities in a single
+# vectorized step. That's what makes moving tens of thousands of bullets per
+# frame feasible in Python.
+
+import heapq
+from typing import List, Optional, cast
+import numpy as np
+import config
+from helpers import Vec2f
+from entities import Entity
+from world import World
+
+
+class ArrayStorage:
+    def __init__(self, capacity: int = 64) -> None:
+        self.positions = np.zeros((capacity, 2), dtype=np.float64)
+        self.rotations = np.zeros(capacity, dtype=np.float64)
+        self.previous_positions = np.zeros((capacity, 2), dtype=np.float64)
+        self.previous_rotations = np.zeros(capacity, dtype=np.float64)
+        self.speeds = np.zeros(capacity, dtype=np.float64)
+        self.radii = np.zeros(capacity, dtype=np.float64)
+        self.active = np.zeros(capacity, dtype=np.bool_)
+
+        # Marks entities moved by move_bullets() rather than by their
+        # BulletMover component.
+        self.bullets = np.zeros(capacity, dtype=np.bool_)
+
+        # Entity per id, or None for ids released. Released ids are handed out
+        # again, lowest first, so the arrays only grow as long as the most
+        # entities alive at once.
+        self.owners: List[Optional[Entity]] = []
+        self.released: List[int] = []
+        self.count = 0
+
+    def allocate(self, owner: Entity) -> int:
+        if self.released:
+            id_ = heapq.heappop(self.released)
+            self.owners[id_] = owner
+            return id_
+        if self.count == len(self.rotations):
+            # Double capacity to get amortized O(1) allocation. Resizing
+            # reallocates the arrays, which is why views index into the storage
+            # on each access rather than hold on to slices.
+            capacity = 2 * len(self.rotations)
+            self.positions = np.resize(self.positions, (capacity, 2))
+            self.rotations = np.resize(self.rotations, capacity)
+            self.previous_positions = np.resize(self.previous_positions,
+                                                (capacity, 2))
+            self.previous_rotations = np.resize(self.previous_rotations,
+                                                capacity)
+            self.speeds = np.resize(self.speeds, capacity)
+            self.radii = np.resize(self.radii, capacity)
+            self.active = np.resize(self.active, capacity)
+            self.bullets = np.resize(self.bullets, capacity)
+            for array in (self.positions, self.rotations,
+                          self.previous_positions, self.previous_rotations,
+                          self.speeds, self.radii, self.active, self.bullets):
+                array[self.count:] = 0
+        self.owners.append(owner)
+        self.count += 1
+        return self.count - 1
+
+    def release(self, id_: int) -> None:
+        """Frees the id of an entity destroyed, clearing its state so
+        vectorized steps skip it until the id is reused."""
+        for array in (self.positions, self.rotations, self.previous_positions,
+                      self.previous_rotations, self.speeds, self.radii,
+                      self.active, self.bullets):
+            array[id_] = 0
+        self.owners[id_] = None
+        heapq.heappush(self.released, id_)
+
+    def add_bullet(self, entity: Entity, speed: float, radius: float) -> None:
+        """Hands movement of entity over to move_bullets()."""
+        id_ = cast(ArrayEntity, entity).id
+        self.speeds[id_] = speed
+        self.radii[id_] = radius
+        self.bullets[id_] = True
+
+    def store_previous_state(self) -> None:
+        """Entity.store_previous_state() for every entity of every world
+        sharing the storage, in one step."""
+        n = self.count
+        self.previous_positions[:n] = self.positions[:n]
+        self.previous_rotations[:n] = self.rotations[:n]
+
+    def move_bullets(self, delta_time: float) -> np.ndarray:
+        """Vectorized equivalent of BulletMover.update() for every active
+        bullet of every world sharing the storage. Returns ids of bullets
+        deactivated for leaving the screen."""
+        n = self.count
+        positions = self.positions[:n]
+        moving = self.active[:n] & self.bullets[:n]
+        was_offscreen = offscreen(positions)
+        rotations = self.rotations[:n][moving]
+        step = self.speeds[:n] * delta_time
+        positions[moving, 0] += step[moving] * np.cos(rotations)
+        positions[moving, 1] += step[moving] * np.sin(rotations)
+
+        # Fast bullets leave play a tick late, as in BulletMover.update().
+        left = moving & offscreen(positions) & (
+            (step <= 2 * self.radii[:n]) | was_offscreen)
+        self.active[:n][left] = False
+        return np.flatnonzero(left)
+
+
+def offscreen(positions: np.ndarray) -> np.ndarray:
+    x = positions[:, 0]
+    y = positions[:, 1]
+    return (x > config.SCREEN_WIDTH) | (x < 0) | \
+        (y > config.SCREEN_HEIGHT) | (y < 0)
+
+
+class ArrayVec2f(Vec2f):
+    """Vec2f whose x and y are a view into ArrayStorage.positions."""
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, storage: ArrayStorage, id_: int) -> None:
+        self.storage = storage
+        self.id = id_
+
+    @property  # type: ignore
+    def x(self) -> float:
+        return float(self.storage.positions[self.id, 0])
+
+    @x.setter
+    def x(self, value: float) -> None:
+        self.storage.positions[self.id, 0] = value
+
+    @property  # type: ignore
+    def y(self) -> float:
+        return float(self.storage.positions[self.id, 1])
+
+    @y.setter
+    def y(self, value: float) -> None:
+        self.storage.positions[self.id, 1] = value
+
+
+class PreviousArrayVec2f(Vec2f):
+    """Vec2f whose x and y are a view into ArrayStorage.previous_positions."""
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, storage: ArrayStorage, id_: int) -> None:
+        self.storage = storage
+        self.id = id_
+
+    @property  # type: ignore
+    def x(self) -> float:
+        return float(self.storage.previous_positions[self.id, 0])
+
+    @x.setter
+    def x(self, value: float) -> None:
+        self.storage.previous_positions[self.id, 0] = value
+
+    @property  # type: ignore
+    def y(self) -> float:
+        return float(self.storage.previous_positions[self.id, 1])
+
+    @y.setter
+    def y(self, value: float) -> None:
+        self.storage.previous_positions[self.id, 1] = value
+
+
+class ArrayEntity(Entity):
+    """Entity whose position, rotation, and active flag are stored in an
+    ArrayStorage. Assigning a new Vec2f to position copies its coordinates into
+    the storage, so the position object itself never changes. That way a
+    Circle holding on to the position keeps following the entity."""
+
+    def __init__(self, world: World) -> None:
+        storage = cast(ArrayStorage, world.array_storage)
+        self.storage = storage
+        self.id = storage.allocate(self)
+        self._position = ArrayVec2f(storage, self.id)
+        self._previous_position = PreviousArrayVec2f(storage, self.id)
+        super().__init__(world)
+
+    @property  # type: ignore
+    def position(self) -> Vec2f:
+        return self._position
+
+    @position.setter
+    def position(self, value: Vec2f) -> None:
+        self.storage.positions[self.id] = (value.x, value.y)
+
+    @property  # type: ignore
+    def rotation(self) -> float:
+        return float(self.storage.rotations[self.id])
+
+    @rotation.setter
+    def rotation(self, value: float) -> None:
+        self.storage.rotations[self.id] = value
+
+    @property  # type: ignore
+    def previous_position(self) -> Vec2f:
+        return self._previous_position
+
+    @previous_position.setter
+    def previous_position(self, value: Vec2f) -> None:
+        self.storage.previous_positions[self.id] = (value.x, value.y)
+
+    @property  # type: ignore
+    def previous_rotation(self) -> float:
+        return float(self.storage.previous_rotations[self.id])
+
+    @previous_rotation.setter
+    def previous_rotation(self, value: float) -> None:
+        self.storage.previous_rotations[self.id] = value
+
+    def store_previous_state(self) -> None:
+        storage = self.storage
+        storage.previous_positions[self.id] = storage.positions[self.id]
+        storage.previous_rotations[self.id] = storage.rotations[self.id]
+
+    @property  # type: ignore
+    def active(self) -> bool:
+        return bool(self.storage.active[self.id])
+
+    @active.setter
+    def active(self, value: bool) -> None:
+        self.storage.active[self.id] = value
+
+    def release(self) -> None:
+        super().release()
+        self.storage.release(self.id)
@@ -0,0 +1,106 @@
+# Update and draw subsystems. Rather than visiting every entity and calling
+# update() and draw() on each of its components, most of which are no-ops, each
+# subsystem queries the world for the entities carrying the component type it
+# handles and calls only that component.
+
+import time
+from typing import Dict, List, Type
+import sdl2
+import components
+from collision import check_collisions
+from metrics import Frame_metrics
+from spritebatch import Sprite_batch
+from storage import ArrayStorage
+from world import World
+
+# Components with a non-trivial update(), in the order they're updated. The
+# order mirrors how entities were originally laid out and updated one at a time:
+# bullets, then the player, then enemies. For instance, a bullet fired by
+# KeyboardShooter mustn't be moved again by BulletMover in the same tick.
+UPDATE_ORDER: List[Type[components.Component]] = [
+    components.BulletMover,
+    components.KeyboardMover,
+    components.KeyboardShooter,
+]
+
+# Components with a non-trivial draw().
+DRAW_ORDER: List[Type[components.Component]] = [
+    components.SpriteRenderer,
+    components.Animator,
+]
+
+
+def run_tick(world: World) -> None:
+    """Advances world by one tick, running every subsystem but drawing."""
+    for entity in world.entities:
+        entity.store_previous_state()
+
+    with Frame_metrics.phase("update"):
+        update(world)
+
+    # Start collision subsystem
+    with Frame_metrics.phase("collision"):
+        check_collisions(world)
+    world.commands.flush()
+    world.advance()
+
+
+def update(world: World) -> None:
+    update_components(world)
+    if world.array_storage is not None:
+        move_bullets(world.array_storage, world.delta_time)
+
+
+def update_components(world: World) -> None:
+    """Runs every component's update() except the ones replaced by vectorized
+    steps, and then the animation system."""
+    per_component = Frame_metrics.enabled and Frame_metrics.per_component
+    for component_type in UPDATE_ORDER:
+        # With array storage, bullets are moved by a single vectorized step
+        # below rather than by each bullet's BulletMover.
+        if component_type is components.BulletMover and \
+                world.array_storage is not None:
+            continue
+
+        start = time.perf_counter() if per_component else 0.0
+        for entity in world.query(component_type):
+            entity.components[component_type].update()
+        if per_component:
+            Frame_metrics.add_component_time(
+                f"{component_type.__name__}.update",
+                time.perf_counter() - start)
+
+    # Every Animator is advanced at once, in place of their update(). A system
+    # shared by several worlds is advanced by whoever runs them.
+    if not world.shares_animations:
+        start = time.perf_counter() if per_component else 0.0
+        world.animations.update(world.time_ms)
+        if per_component:
+            Frame_metrics.add_component_time(
+                "AnimationSystem.update", time.perf_counter() - start)
+
+    # Sync point. Bullets fired enter play, in time to be moved by
+    # move_bullets() and tested for collision.
+    world.commands.flush()
+
+
+def move_bullets(storage: ArrayStorage, delta_time: float) -> None:
+    """Moves the bullets of every world sharing storage in one step."""
+    worlds: Dict[World, None] = {}
+    for id_ in storage.move_bullets(delta_time):
+        # Bullets leaving the screen are already inactive, but must still be
+        # returned to their pool.
+        owner = storage.owners[id_]
+        owner.deactivate()
+        worlds[owner.world] = None
+
+    # Sync point, for every world whose bullets left the screen.
+    for world in worlds:
+        world.commands.flush()
+
+
+def draw(world: World, renderer: sdl2.render.SDL_Renderer) -> None:
+    for component_type in DRAW_ORDER:
+        for entity in world.query(component_type):
+            entity.components[component_type].draw(renderer)
+    Sprite_batch.flush(renderer)
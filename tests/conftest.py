@@ -0,0 +1,12 @@
+# Modules live at the top of the repository and load sprites by paths relative
+# to it, so tests run from there, as the game does.
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# components and entities import each other, and only work imported in this
+# order.
+import entities  # noqa: E402,F401  pylint: disable=wrong-import-position
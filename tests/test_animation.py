@@ -0,0 +1,38 @@
+import components
+import entities
+import systems
+from animation import AnimationSystem
+from world import World
+
+
+def enemy_frames(world: World) -> list:
+    return [e.get_component(components.Animator).current_frame
+            for e in world.enemy_pool.active()]
+
+
+def test_shared_system_advances_each_world_by_its_own_time() -> None:
+    shared = AnimationSystem()
+    ahead = World(animations=shared)
+    behind = World(animations=shared)
+    alone = World()
+    for world in (ahead, behind, alone):
+        entities.create_game(world, None)
+
+    # Idle frames change 5 times a second. Only worlds a fifth of a second
+    # into the game have advanced.
+    ahead.time_ms = alone.time_ms = 200.0
+    behind.time_ms = 100.0
+    shared.update_worlds()
+    alone.animations.update(alone.time_ms)
+    assert set(enemy_frames(ahead)) == {1}
+    assert set(enemy_frames(behind)) == {0}
+    assert enemy_frames(ahead) == enemy_frames(alone)
+
+
+def test_shared_system_isnt_advanced_per_world() -> None:
+    shared = AnimationSystem()
+    world = World(animations=shared)
+    entities.create_game(world, None)
+    world.time_ms = 1000.0
+    systems.update_components(world)
+    assert set(enemy_frames(world)) == {0}
@@ -0,0 +1,37 @@
+from typing import Any, Iterator
+import pytest
+import atlas
+from assets import Sequence, Texture_cache
+import config
+
+
+@pytest.fixture
+def built_atlas(tmp_path: Any, monkeypatch: Any) -> Iterator[atlas.Atlas]:
+    # Timing that differs from what the game passes, so it's clear which one
+    # a sequence ends up with.
+    monkeypatch.setitem(config.SEQUENCES, "sprites/enemy/idle", (9, False))
+    output = str(tmp_path / "sprites.atlas")
+    atlas.build("sprites", output)
+    built = atlas.Atlas(output)
+    Texture_cache.use_atlas(built)
+    yield built
+    Texture_cache.clear()
+    Texture_cache.atlas = None
+
+
+def test_sequence_takes_timing_from_atlas(built_atlas: atlas.Atlas) -> None:
+    info = built_atlas.sequences["sprites/enemy/idle"]
+    assert (info.frame_rate, info.loop) == (9, False)
+    sequence = Sequence(None, "sprites/enemy/idle", 5, True)
+    assert sequence.sample_rate == 9
+    assert not sequence.loop
+    assert sequence.filenames == info.frames
+    sequence.release()
+
+
+def test_sequence_without_atlas_keeps_given_timing() -> None:
+    sequence = Sequence(None, "sprites/enemy/idle", 5, True)
+    assert sequence.sample_rate == 5
+    assert sequence.loop
+    sequence.release()
+    Texture_cache.clear()
@@ -0,0 +1,49 @@
+import tracemalloc
+from typing import List
+import collision
+import components
+import entities
+from helpers import Vec2f
+from world import World
+
+
+def destroyed(enemies: List[entities.Entity]) -> List[entities.Entity]:
+    return [e for e in enemies
+            if e.get_component(components.Animator)
+            .current_animation_playing == "destroy"]
+
+
+def test_fast_bullets_hit_in_large_world() -> None:
+    # Enemies spread over a large playfield, with a bullet under each of the
+    # first few which jumps right over it in a single tick. Only sweeping its
+    # path finds the hit.
+    world = World()
+    bullets = 500
+    entities.initialize_bullet_pool(world, None, bullets)
+    entities.initialize_enemy_pool(world, None, 5 * bullets)
+    enemies = [entities.enemy_from_pool(
+        world, Vec2f(200 * (i % 50), 300 * (i // 50)))
+        for i in range(5 * bullets)]
+    for enemy in enemies[:bullets]:
+        assert enemy is not None
+        bullet = entities.bullet_from_pool(world)
+        assert bullet is not None
+        bullet.position.x = enemy.position.x
+        bullet.position.y = enemy.position.y + 60
+        bullet.store_previous_state()
+        bullet.position.y = enemy.position.y - 60
+    world.commands.flush()
+
+    tracemalloc.start()
+    collision.check_collisions(world)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    hit = destroyed([e for e in enemies if e is not None])
+    assert hit == enemies[:bullets]
+    assert len(world.entities) == len(enemies)
+
+    # Testing every bullet against every circle at once would take at least
+    # bullets * circles * 8 bytes per array.
+    assert peak < bullets * len(enemies) * 8
+    entities.destroy_game(world)
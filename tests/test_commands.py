@@ -0,0 +1,117 @@
+from typing import List
+import collision
+import components
+import entities
+from commands import CommandBuffer
+from world import World
+
+
+def spawned(world: World, n: int) -> List[entities.Entity]:
+    created = [entities.new_entity(world) for _ in range(n)]
+    for entity in created:
+        world.commands.spawn(entity)
+    world.commands.flush()
+    return created
+
+
+def test_nothing_changes_until_flushed() -> None:
+    world = World()
+    a, b = spawned(world, 2)
+    c = entities.new_entity(world)
+    world.commands.spawn(c)
+    world.commands.despawn(a)
+    assert list(world.entities) == [a, b]
+    assert a.active and not world.commands.will_be_active(a)
+    assert world.commands.will_be_active(c)
+    world.commands.flush()
+    assert list(world.entities) == [b, c]
+    assert not a.active
+    assert len(world.commands) == 0
+
+
+def test_spawn_then_despawn_cancels_out() -> None:
+    world = World()
+    a = entities.new_entity(world)
+    world.commands.spawn(a)
+    world.commands.despawn(a)
+    world.commands.flush()
+    assert a not in world.entities
+    assert not a.active
+
+
+def test_despawn_then_spawn_moves_to_back() -> None:
+    world = World()
+    a, b, c = spawned(world, 3)
+    world.commands.despawn(a)
+    world.commands.spawn(a)
+    world.commands.flush()
+    assert list(world.entities) == [b, c, a]
+    assert a.active
+
+
+def test_order_matches_applying_one_at_a_time() -> None:
+    world = World()
+    a, b, c = spawned(world, 3)
+    d = entities.new_entity(world)
+    world.commands.spawn(d)
+    world.commands.despawn(b)
+    world.commands.spawn(b)
+    world.commands.despawn(c)
+    world.commands.flush()
+    assert list(world.entities) == [a, d, b]
+
+
+def test_component_changes_index_on_flush() -> None:
+    world = World()
+    a, = spawned(world, 1)
+    shooter = components.KeyboardShooter(a, 100)
+    a.add_component(shooter)
+    assert list(world.query(components.KeyboardShooter)) == []
+    world.commands.flush()
+    assert list(world.query(components.KeyboardShooter)) == [a]
+    a.remove_component(components.KeyboardShooter)
+    world.commands.flush()
+    assert list(world.query(components.KeyboardShooter)) == []
+
+
+def test_clear_drops_pending_commands() -> None:
+    world = World()
+    a, = spawned(world, 1)
+    world.commands.despawn(a)
+    world.commands.clear()
+    assert world.commands.will_be_active(a)
+    world.commands.flush()
+    assert list(world.entities) == [a]
+
+
+def test_bullet_overlapping_two_enemies_destroys_one() -> None:
+    world = World()
+    entities.initialize_bullet_pool(world, None, 1)
+    entities.initialize_enemy_pool(world, None, 2)
+    first = entities.enemy_from_pool(world, entities.Vec2f(100, 100))
+    second = entities.enemy_from_pool(world, entities.Vec2f(100, 100))
+    bullet = entities.bullet_from_pool(world)
+    assert first is not None and second is not None and bullet is not None
+    bullet.position.x = bullet.position.y = 100
+    bullet.store_previous_state()
+    world.commands.flush()
+
+    flushes = []
+    flush = CommandBuffer.flush
+
+    def counting_flush(self: CommandBuffer) -> None:
+        flushes.append(len(self))
+        flush(self)
+
+    CommandBuffer.flush = counting_flush  # type: ignore
+    try:
+        collision.check_collisions(world)
+    finally:
+        CommandBuffer.flush = flush  # type: ignore
+
+    destroyed = [e for e in (first, second)
+                 if e.get_component(components.Animator)
+                 .current_animation_playing == "destroy"]
+    assert len(destroyed) == 1
+    assert bullet not in world.entities
+    assert len(flushes) == 1
@@ -0,0 +1,56 @@
+import threading
+from metrics import FrameMetrics
+
+
+def enabled(capacity: int = 100000) -> FrameMetrics:
+    metrics = FrameMetrics(capacity)
+    metrics.enabled = True
+    return metrics
+
+
+def test_other_threads_join_frame_when_handed_over() -> None:
+    metrics = enabled()
+
+    def work(hand_over: bool) -> None:
+        with metrics.phase("update"):
+            metrics.count("ticks")
+        if hand_over:
+            metrics.hand_over()
+
+    worker = threading.Thread(target=work, args=(False,))
+    worker.start()
+    worker.join()
+    metrics.end_frame()
+    assert "ticks" not in metrics.counters
+
+    worker = threading.Thread(target=work, args=(True,))
+    worker.start()
+    worker.join()
+    metrics.count("frames")
+    metrics.end_frame()
+    assert metrics.counters["ticks"].values() == [0, 1]
+    assert metrics.counters["frames"].values() == [0, 1]
+    assert metrics.phases["update"].values()[1] > 0
+
+
+def test_batches_are_never_split_or_lost() -> None:
+    metrics = enabled()
+    batches = 2000
+    batch = 7
+
+    def simulate() -> None:
+        for _ in range(batches):
+            for _ in range(batch):
+                metrics.count("ticks")
+            metrics.hand_over()
+
+    worker = threading.Thread(target=simulate)
+    worker.start()
+    while worker.is_alive():
+        metrics.end_frame()
+    worker.join()
+    metrics.end_frame()
+
+    counts = metrics.counters["ticks"].values()
+    assert sum(counts) == batches * batch
+    assert all(n % batch == 0 for n in counts)
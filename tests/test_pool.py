@@ -0,0 +1,82 @@
+from typing import Optional
+import entities
+from pool import Pool
+from world import World
+
+
+def create_pool(size: int, grow_by: int = 0, max_size: Optional[int] = None) -> Pool:
+    world = World()
+    return Pool(world, lambda: entities.new_entity(world), size,
+                grow_by=grow_by, max_size=max_size)
+
+
+def test_acquire_enters_play_when_flushed() -> None:
+    pool = create_pool(2)
+    entity = pool.acquire()
+    assert entity is not None
+    assert entity not in pool.world.entities
+    pool.world.commands.flush()
+    assert entity in pool.world.entities
+    assert entity.active
+    assert pool.active() == [entity]
+
+
+def test_release_swaps_to_idle_side() -> None:
+    pool = create_pool(3)
+    first, second, third = [pool.acquire() for _ in range(3)]
+    pool.world.commands.flush()
+    pool.release(first)
+    pool.world.commands.flush()
+    assert pool.active_count == 2
+    assert set(pool.active()) == {second, third}
+    assert pool.entities[2] is first
+    assert all(pool.slots[e] == i for i, e in enumerate(pool.entities))
+    assert first not in pool.world.entities
+    assert not first.active
+
+
+def test_release_idle_entity_does_nothing() -> None:
+    pool = create_pool(2)
+    entity = pool.acquire()
+    pool.release(entity)
+    pool.release(entity)
+    assert pool.active_count == 0
+
+
+def test_acquire_and_release_in_same_tick_cancel_out() -> None:
+    pool = create_pool(1)
+    entity = pool.acquire()
+    pool.release(entity)
+    pool.world.commands.flush()
+    assert entity not in pool.world.entities
+    assert not entity.active
+
+
+def test_exhausted_fixed_pool_returns_none() -> None:
+    pool = create_pool(1)
+    assert pool.acquire() is not None
+    assert pool.acquire() is None
+    assert pool.stats()["exhausted"] == 1
+
+
+def test_grows_up_to_max_size() -> None:
+    pool = create_pool(1, grow_by=2, max_size=2)
+    assert pool.acquire() is not None
+    assert pool.acquire() is not None
+    assert pool.acquire() is None
+    assert pool.stats() == {"size": 2, "active": 2, "high_water_mark": 2,
+                            "grows": 1, "exhausted": 1}
+
+
+def test_reused_entity_is_reset() -> None:
+    world = World()
+    entities.initialize_enemy_pool(world, None, 1)
+    enemy = entities.enemy_from_pool(world, entities.Vec2f(10, 20))
+    world.commands.flush()
+    assert enemy is not None
+    enemy.position.x = 500
+    world.enemy_pool.release(enemy)
+    world.commands.flush()
+    again = entities.enemy_from_pool(world, entities.Vec2f(30, 40))
+    assert again is enemy
+    assert (enemy.position.x, enemy.position.y) == (30, 40)
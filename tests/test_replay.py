@@ -0,0 +1,69 @@
+from typing import Any, Optional, Tuple
+import pytest
+import controls
+import entities
+import replay
+import snapshot
+import systems
+from storage import ArrayStorage
+from world import World
+
+TICKS = 900
+
+
+def play(world: World, ticks: int, recorder: Optional[replay.Recorder] = None) -> None:
+    source = controls.RandomInput(seed=7)
+    for _ in range(ticks):
+        mask = source.read(world.tick)
+        if recorder is not None:
+            recorder.record(world, mask)
+        controls.apply(world, mask)
+        systems.run_tick(world)
+
+
+def new_world(array_storage: bool) -> World:
+    world = World(ArrayStorage() if array_storage else None)
+    entities.create_game(world, None)
+    return world
+
+
+@pytest.mark.parametrize("array_storage", [False, True])
+def test_same_input_gives_same_game(array_storage: bool) -> None:
+    first = new_world(array_storage)
+    second = new_world(array_storage)
+    play(first, TICKS)
+    play(second, TICKS)
+    assert snapshot.save(first) == snapshot.save(second)
+
+
+@pytest.fixture(params=[False, True], ids=["objects", "numpy"])
+def recorded(request: Any, tmp_path: Any) -> Tuple[replay.Recording, bytes]:
+    filename = str(tmp_path / "game.rec")
+    world = new_world(request.param)
+    recorder = replay.Recorder(world, filename, keyframe_interval=200)
+    play(world, TICKS, recorder)
+    recorder.close()
+    return replay.load(filename), snapshot.save(world)
+
+
+def test_replay_reproduces_game(recorded: Tuple[replay.Recording, bytes]) -> None:
+    recording, final = recorded
+    assert len(recording) == TICKS
+    assert sorted(recording.keyframes) == [0, 200, 400, 600, 800]
+    world = replay.create_world(recording)
+    replay.replay(world, recording)
+    assert snapshot.save(world) == final
+
+
+@pytest.mark.parametrize("tick", [0, 150, 400, 799, TICKS])
+def test_seek_matches_replaying_from_start(recorded: Tuple[replay.Recording, bytes],
+                                           tick: int) -> None:
+    recording, _ = recorded
+    expected = replay.create_world(recording)
+    replay.replay(expected, recording, tick)
+
+    world = replay.create_world(recording)
+    replay.seek(world, recording, TICKS)
+    replay.seek(world, recording, tick)
+    assert world.tick == tick
+    assert snapshot.save(world) == snapshot.save(expected)
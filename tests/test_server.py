@@ -0,0 +1,174 @@
+import asyncio
+from typing import Any, List, Tuple
+import numpy as np
+import pytest
+import controls
+import entities
+import server
+import systems
+from world import World
+
+
+def played(ticks: int) -> World:
+    world = World()
+    entities.create_game(world, None)
+    bot = controls.RandomInput(1)
+    for tick in range(ticks):
+        controls.apply(world, bot.read(tick))
+        systems.run_tick(world)
+    return world
+
+
+def test_quantize_round_trip() -> None:
+    world = played(200)
+    rows = server.dequantize(server.quantize(world, None))
+    in_play = sorted(e.serial for e in world.entities if e.active)
+    assert list(rows[:, 0]) == in_play
+    for serial, kind, x, y, rotation, _, _ in rows:
+        entity = world.owned[int(serial)]
+        assert kind != server.KIND_NONE
+        assert x == pytest.approx(entity.position.x,
+                                  abs=server.POSITION_QUANTUM / 2)
+        assert y == pytest.approx(entity.position.y,
+                                  abs=server.POSITION_QUANTUM / 2)
+        assert rotation == pytest.approx(entity.rotation % (2 * np.pi),
+                                         abs=server.ROTATION_QUANTUM)
+    entities.destroy_game(world)
+
+
+def test_interest_distance_culls() -> None:
+    world = played(200)
+    player = world.player
+    assert player is not None
+    rows = server.dequantize(server.quantize(world, 150))
+    near = sorted(e.serial for e in world.entities if e.active and
+                  (e.position.x - player.position.x) ** 2 +
+                  (e.position.y - player.position.y) ** 2 <= 150 ** 2)
+    assert player.serial in near
+    assert list(rows[:, 0]) == near
+    assert len(near) < sum(e.active for e in world.entities)
+    entities.destroy_game(world)
+
+
+def test_encode_round_trip() -> None:
+    world = played(100)
+    baseline = server.quantize(world, None)
+    systems.run_tick(world)
+    state = server.quantize(world, None)
+    assert server.decode(None, server.encode(None, state)) == state
+    delta = server.encode(baseline, state)
+    assert server.decode(baseline, delta) == state
+    assert len(delta) < len(server.encode(None, state))
+    entities.destroy_game(world)
+
+
+def read(data: bytes, max_size: int) -> Tuple[int, bytes]:
+    async def run() -> Tuple[int, bytes]:
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await server.read_message(reader, max_size)
+    return asyncio.run(run())
+
+
+def test_read_message_limits_size() -> None:
+    body = server.INPUT_BODY.pack(5, 1, -1)
+    message = server.MESSAGE.pack(server.INPUT, len(body)) + body
+    assert read(message, len(body)) == (server.INPUT, body)
+    with pytest.raises(ValueError):
+        read(message, len(body) - 1)
+
+
+class BackedUpTransport:
+    def __init__(self) -> None:
+        self.aborted = False
+
+    def get_write_buffer_size(self) -> int:
+        return server.MAX_WRITE_BUFFER + 1
+
+    def abort(self) -> None:
+        self.aborted = True
+
+
+class BackedUpWriter:
+    def __init__(self) -> None:
+        self.transport = BackedUpTransport()
+        self.written: List[bytes] = []
+
+    def write(self, data: bytes) -> None:
+        self.written.append(data)
+
+
+def test_backed_up_client_is_skipped_then_dropped() -> None:
+    writer = BackedUpWriter()
+    session = server.Session(1, writer, None)  # type: ignore
+    for _ in range(server.MAX_BACKED_UP - 1):
+        session.send_state()
+    assert not writer.written and not writer.transport.aborted
+    session.send_state()
+    assert writer.transport.aborted
+    entities.destroy_game(session.world)
+
+
+def test_malformed_input_is_rejected() -> None:
+    session = server.Session(1, BackedUpWriter(), None)  # type: ignore
+    with pytest.raises(ValueError):
+        session.receive(bytes(server.INPUT_BODY.size - 1))
+    entities.destroy_game(session.world)
+
+
+async def serving(test: Any) -> Any:
+    """Runs test(server, port) against a server listening on a free port."""
+    host = server.Server()
+    listener = await asyncio.start_server(host.handle, "127.0.0.1", 0)
+    ticker = asyncio.ensure_future(host.run())
+    try:
+        return await test(host, listener.sockets[0].getsockname()[1])
+    finally:
+        host.running = False
+        await ticker
+        listener.close()
+        await listener.wait_closed()
+
+
+def test_client_decodes_states_sent(monkeypatch: Any) -> None:
+    # Keeps what the server sends as it's sent.
+    sent = {}
+    send_state = server.Session.send_state
+
+    def record(session: server.Session) -> None:
+        send_state(session)
+        sent[session.world.tick] = session.sent.get(session.world.tick)
+
+    monkeypatch.setattr(server.Session, "send_state", record)
+
+    async def test(host: server.Server, port: int) -> None:
+        client = server.Client(controls.RandomInput(3))
+        await client.run("127.0.0.1", port, ticks=60)
+        assert client.session == 1
+        assert client.latest >= 60
+        assert client.states
+        for tick, state in client.states.items():
+            assert state == sent[tick]
+
+        # The session ends with the connection.
+        await asyncio.sleep(0.1)
+        assert not host.sessions
+
+    asyncio.run(serving(test))
+
+
+def test_oversized_message_disconnects() -> None:
+    async def test(host: server.Server, port: int) -> bytes:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(server.MESSAGE.pack(server.INPUT,
+                                         server.MAX_MESSAGE_SIZE + 1))
+        await writer.drain()
+        received = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        assert not host.sessions
+        return received
+
+    received = asyncio.run(serving(test))
+    kind, _ = server.MESSAGE.unpack_from(received)
+    assert kind == server.WELCOME
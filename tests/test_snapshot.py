@@ -0,0 +1,75 @@
+import pytest
+import controls
+import entities
+import snapshot
+import systems
+from storage import ArrayStorage
+from world import World
+
+
+def played_world(array_storage: bool, ticks: int) -> World:
+    world = World(ArrayStorage() if array_storage else None)
+    entities.create_game(world, None)
+    source = controls.RandomInput(seed=3)
+    for _ in range(ticks):
+        controls.apply(world, source.read(world.tick))
+        systems.run_tick(world)
+    return world
+
+
+@pytest.mark.parametrize("array_storage", [False, True])
+def test_restore_round_trips(array_storage: bool) -> None:
+    world = played_world(array_storage, 300)
+    data = snapshot.save(world)
+
+    other = played_world(array_storage, 0)
+    snapshot.load(other, data)
+    assert snapshot.save(other) == data
+    assert [e.serial for e in other.entities] == \
+        [e.serial for e in world.entities]
+
+
+@pytest.mark.parametrize("array_storage", [False, True])
+def test_restored_world_plays_on_identically(array_storage: bool) -> None:
+    world = played_world(array_storage, 300)
+    other = played_world(array_storage, 0)
+    snapshot.load(other, snapshot.save(world))
+    for w in (world, other):
+        for _ in range(200):
+            controls.apply(w, controls.FIRE | controls.MOVE_LEFT)
+            systems.run_tick(w)
+    assert snapshot.save(other) == snapshot.save(world)
+
+
+def test_capture_reuses_buffer_while_layout_holds() -> None:
+    world = played_world(False, 10)
+    snapshotter = snapshot.Snapshotter(world)
+    first = bytes(snapshotter.capture())
+    buffer = snapshotter.buffer
+    systems.run_tick(world)
+    second = bytes(snapshotter.capture())
+    assert snapshotter.buffer is buffer
+    assert len(first) == len(second)
+    assert first != second
+
+
+def test_delta_round_trips() -> None:
+    world = played_world(False, 100)
+    previous = snapshot.save(world)
+    systems.run_tick(world)
+    current = snapshot.save(world)
+    encoded = snapshot.delta(previous, current)
+    assert len(encoded) < len(current)
+    assert snapshot.undelta(previous, encoded) == current
+
+
+def test_delta_rejects_different_layouts() -> None:
+    with pytest.raises(ValueError):
+        snapshot.delta(b"\0" * 4, b"\0" * 5)
+
+
+def test_restore_rejects_wrong_size() -> None:
+    world = played_world(False, 0)
+    data = snapshot.save(world)
+    with pytest.raises(ValueError):
+        snapshot.load(world, data + b"\0")
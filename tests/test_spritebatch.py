@@ -0,0 +1,48 @@
+import ctypes
+from typing import Any, Iterator, Tuple
+import pytest
+import sdl2
+from assets import Texture_cache
+from helpers import sdl, Vec2f
+from spritebatch import SpriteBatch
+import config
+
+
+@pytest.fixture
+def target() -> Iterator[Tuple[Any, Any]]:
+    # Draws to a surface in memory, so no display or video driver is needed.
+    surface = sdl(sdl2.SDL_CreateRGBSurfaceWithFormat(
+        0, config.SCREEN_WIDTH, config.SCREEN_HEIGHT, 32,
+        sdl2.SDL_PIXELFORMAT_RGBA32))
+    renderer = sdl(sdl2.SDL_CreateSoftwareRenderer(surface))
+    yield renderer, surface
+    Texture_cache.clear()
+    sdl2.SDL_DestroyRenderer(renderer)
+    sdl2.SDL_FreeSurface(surface)
+
+
+def pixel(surface: Any, x: int, y: int) -> int:
+    contents = surface.contents
+    row = ctypes.cast(contents.pixels, ctypes.POINTER(ctypes.c_uint8))
+    offset = y * contents.pitch + 4 * x
+    return int.from_bytes(bytes(row[offset:offset + 4]), "little")
+
+
+def test_fallback_draws_with_copies(target: Tuple[Any, Any],
+                                    monkeypatch: Any) -> None:
+    renderer, surface = target
+
+    # As on SDL older than 2.0.18, where the binding exists but raises.
+    def missing(*args: Any) -> None:
+        raise RuntimeError("SDL_RenderGeometry isn't available")
+    monkeypatch.setattr(sdl2, "SDL_RenderGeometry", missing)
+
+    batch = SpriteBatch(4, use_geometry=False)
+    sprite = Texture_cache.acquire(renderer, "sprites/player.bmp")
+    for i in range(8):
+        batch.add(sprite, Vec2f(100 + 60 * i, 400), 0)
+    batch.flush(renderer)
+    assert batch.drawn == 8
+    assert pixel(surface, 100, 400) != 0
+    assert pixel(surface, 10, 10) == 0
+    Texture_cache.release(renderer, "sprites/player.bmp")
@@ -0,0 +1,48 @@
+from typing import List, cast
+import entities
+import systems
+from storage import ArrayEntity, ArrayStorage
+from world import World
+
+
+def ids(world: World) -> List[int]:
+    return sorted(cast(ArrayEntity, e).id for e in world.owned)
+
+
+def test_ids_of_destroyed_entities_are_reused() -> None:
+    storage = ArrayStorage()
+    world = World(storage)
+    entities.create_game(world, None)
+    for _ in range(50):
+        systems.run_tick(world)
+    used = ids(world)
+    count = storage.count
+    entities.destroy_game(world)
+    assert sorted(storage.released) == used
+    assert not storage.active[:count].any()
+    assert not storage.bullets[:count].any()
+
+    # A new game takes the same ids rather than growing the storage.
+    entities.create_game(world, None)
+    assert storage.count == count
+    assert ids(world) == used
+    assert all(storage.owners[cast(ArrayEntity, e).id] is e
+               for e in world.owned)
+    entities.destroy_game(world)
+
+
+def test_reused_ids_leave_other_worlds_alone() -> None:
+    storage = ArrayStorage()
+    first = World(storage)
+    second = World(storage)
+    entities.create_game(first, None)
+    entities.create_game(second, None)
+    kept = ids(second)
+    positions = storage.positions[kept].copy()
+    entities.destroy_game(first)
+    entities.create_game(first, None)
+    assert ids(second) == kept
+    assert (storage.positions[kept] == positions).all()
+    assert not set(ids(first)) & set(kept)
+    entities.destroy_game(first)
+    entities.destroy_game(second)
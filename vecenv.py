@@ -0,0 +1,199 @@
+# Runs many independent games side by side in one process, stepping them in
+# lockstep without a window or renderer. Meant for bots and balance testing,
+# where thousands of episodes are needed rather than one game played by a
+# human.
+#
+# Each game is a World of its own, but every world keeps its entities in a
+# single shared ArrayStorage. That way the hot loops run once per tick across
+# all worlds rather than once per world: bullets of every world are moved in
+# one vectorized step, circles of every world are tested for collision in
+# another, animations of every world are advanced in a third, and
+# observations are gathered from the storage arrays with fancy indexing.
+# The interface mimics that of a vectorized gym environment:
+#
+#   env = VectorEnv(256)
+#   observations = env.reset()
+#   while True:
+#       observations, rewards, dones, infos = env.step(policy(observations))
+#
+#   $ python3 vecenv.py --worlds 256 --ticks 3600
+
+import argparse
+import time
+from typing import Any, Dict, List, Sequence, Tuple, cast
+import numpy as np
+import collision
+import controls
+import entities
+import systems
+from animation import AnimationSystem
+from storage import ArrayEntity, ArrayStorage
+from world import World
+import config
+
+# Input mask of each action an agent can pick. An action is an index into
+# ACTIONS.
+ACTIONS: List[int] = [
+    0,
+    controls.MOVE_LEFT,
+    controls.MOVE_RIGHT,
+    controls.FIRE,
+    controls.MOVE_LEFT | controls.FIRE,
+    controls.MOVE_RIGHT | controls.FIRE,
+]
+ACTION_NAMES = ["noop", "left", "right", "fire", "left_fire", "right_fire"]
+
+# An episode ends when every enemy has been destroyed or after this many ticks,
+# one minute of game time.
+MAX_EPISODE_TICKS = 60 * config.TARGET_TICKS_PER_SECOND
+
+
+class VectorEnv:
+    """N headless games stepped in lockstep.
+
+    Observations are an (N, observation_size) float32 array. Each row holds the
+    player's x position, the share of the bullet pool in flight, and for every
+    enemy its x position, its y position, and whether it's alive. Positions are
+    normalized to the screen. The reward for a tick is the number of enemies
+    destroyed during it. Worlds whose episode ends are reset automatically, and
+    their last observation is passed on in their info dictionary."""
+
+    def __init__(self, num_worlds: int,
+                 max_episode_ticks: int = MAX_EPISODE_TICKS) -> None:
+        # Room for the initial entities of every world, and then some, so
+        # storage rarely has to grow.
+        self.storage = ArrayStorage(num_worlds * 64)
+        self.animations = AnimationSystem(num_worlds * 64)
+        self.worlds: List[World] = []
+        for _ in range(num_worlds):
+            world = World(self.storage, self.animations)
+            entities.create_game(world, None)
+            self.worlds.append(world)
+
+        # Storage ids of each world's player and enemies, one row per world.
+        # Enemies are pooled, so the same entities are reused by every episode
+        # and the order of columns never changes.
+        self.player_ids = np.array(
+            [cast(ArrayEntity, w.player).id for w in self.worlds])
+        self.enemy_ids = np.array(
+            [[cast(ArrayEntity, e).id for e in w.enemy_pool.entities]
+             for w in self.worlds if w.enemy_pool is not None])
+        self.enemy_count = self.enemy_ids.shape[1]
+        self.observation_size = 2 + 3 * self.enemy_count
+
+        self.max_episode_ticks = max_episode_ticks
+        self.episode_ticks = np.zeros(num_worlds, dtype=np.int64)
+
+    def close(self) -> None:
+        """Destroys every world, releasing their shared assets."""
+        for world in self.worlds:
+            entities.destroy_game(world)
+        self.worlds.clear()
+
+    def __len__(self) -> int:
+        return len(self.worlds)
+
+    def reset(self) -> np.ndarray:
+        for i in range(len(self.worlds)):
+            self.reset_world(i)
+        return self.observe()
+
+    def reset_world(self, i: int) -> None:
+        entities.reset_game(self.worlds[i])
+        self.episode_ticks[i] = 0
+
+    def step(self, actions: Sequence[int]) -> Tuple[
+            np.ndarray, np.ndarray, np.ndarray, List[Dict[str, Any]]]:
+        """Advances every world by one tick, with actions holding one action
+        per world. Returns observations, rewards, and whether the episode
+        ended, each indexed by world, along with an info dictionary per
+        world."""
+        alive_before = self.alive().sum(axis=1)
+
+        # Collision detection tells fast movers by how far they moved since
+        # the previous tick.
+        self.storage.store_previous_state()
+
+        for world, action in zip(self.worlds, actions):
+            controls.apply(world, ACTIONS[action])
+            systems.update_components(world)
+
+        # Enemies finishing their destroy animation leave play, so flush
+        # commands the same way update_components() otherwise would.
+        self.animations.update_worlds()
+        for world in self.worlds:
+            world.commands.flush()
+
+        # Worlds step in lockstep, so they share a tick length.
+        systems.move_bullets(self.storage, self.worlds[0].delta_time)
+
+        collision.check_collisions_batched(self.worlds)
+
+        for world in self.worlds:
+            world.advance()
+        self.episode_ticks += 1
+
+        alive = self.alive().sum(axis=1)
+        rewards = (alive_before - alive).astype(np.float32)
+        dones = (alive == 0) | (self.episode_ticks >= self.max_episode_ticks)
+        observations = self.observe()
+        infos: List[Dict[str, Any]] = [{} for _ in self.worlds]
+        for i in np.flatnonzero(dones):
+            infos[i] = {
+                "final_observation": observations[i].copy(),
+                "episode_ticks": int(self.episode_ticks[i]),
+                "won": bool(alive[i] == 0),
+            }
+            self.reset_world(i)
+        if dones.any():
+            observations = self.observe()
+        return observations, rewards, dones, infos
+
+    def alive(self) -> np.ndarray:
+        return self.storage.active[self.enemy_ids]
+
+    def observe(self) -> np.ndarray:
+        width = config.SCREEN_WIDTH
+        height = config.SCREEN_HEIGHT
+        n = self.enemy_count
+        positions = self.storage.positions
+        observations = np.empty((len(self.worlds), self.observation_size),
+                                dtype=np.float32)
+        observations[:, 0] = positions[self.player_ids, 0] / width
+        observations[:, 1] = [
+            w.bullet_pool.active_count / len(w.bullet_pool.entities)
+            if w.bullet_pool is not None else 0
+            for w in self.worlds]
+        observations[:, 2:2 + n] = positions[self.enemy_ids, 0] / width
+        observations[:, 2 + n:2 + 2 * n] = \
+            positions[self.enemy_ids, 1] / height
+        observations[:, 2 + 2 * n:] = self.alive()
+        return observations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs games in lockstep with a random policy")
+    parser.add_argument("--worlds", type=int, default=256,
+                        help="number of games run side by side")
+    parser.add_argument("--ticks", type=int, default=3600,
+                        help="ticks to step every game")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    env = VectorEnv(args.worlds)
+    env.reset()
+    episodes = 0
+    wins = 0
+    start = time.perf_counter()
+    for _ in range(args.ticks):
+        _, _, done, info = env.step(rng.randint(len(ACTIONS), size=len(env)))
+        episodes += int(done.sum())
+        wins += sum(1 for i in info if i.get("won"))
+    elapsed = time.perf_counter() - start
+    env.close()
+    print(f"{args.worlds} worlds x {args.ticks} ticks in {elapsed:.3f} s "
+          f"({args.worlds * args.ticks / elapsed:.0f} world ticks/s, "
+          f"{episodes} episodes, {wins} won, "
+          f"{episodes / elapsed * 60:.0f} episodes/min)")
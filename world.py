@@ -0,0 +1,129 @@
+from typing import Dict, Iterator, List, Optional, Type, TYPE_CHECKING
+from animation import AnimationSystem
+from commands import CommandBuffer
+from controls import Input
+import config
+
+if TYPE_CHECKING:
+    import components
+    import entities
+    from pool import Pool
+    from storage import ArrayStorage
+
+ComponentType = Type["components.Component"]
+
+
+class World:
+    """Owns the state of one game: every entity in play, the pools entities
+    are taken from, and the game's notion of time and input. As nothing about a
+    game lives in module globals, any number of games can be run side by side
+    in one process, such as by vecenv.VectorEnv.
+
+    Entities in play are registered with an index from component type to the
+    entities having a component of that type. Rather than visiting every
+    entity and dispatching to every component, including the many no-op
+    implementations, a system queries for the entities carrying the components
+    it cares about and visits only those."""
+
+    def __init__(self, array_storage: Optional["ArrayStorage"] = None,
+                 animations: Optional[AnimationSystem] = None) -> None:
+        # Dictionaries serve as ordered sets, making removal O(1) while keeping
+        # iteration order stable. Iterating entities in order of addition makes
+        # systems, such as collision detection, deterministic.
+        self.entities: Dict["entities.Entity", None] = {}
+        self.index: Dict[ComponentType, Dict["entities.Entity", None]] = {}
+
+        # When set, entities keep their position, rotation, and active flag in
+        # NumPy arrays rather than in Python objects, allowing systems to
+        # process them in vectorized steps. Several worlds may share one
+        # storage, letting a single step process all of them at once.
+        self.array_storage = array_storage
+
+        # Advances every Animator in the world at once. Like storage, several
+        # worlds may share one system, in which case whoever runs them
+        # advances it once for all of them rather than once per world.
+        self.animations = animations if animations is not None \
+            else AnimationSystem()
+        self.shares_animations = animations is not None
+
+        # Set up by entities.create_game().
+        self.player: Optional["entities.Entity"] = None
+        self.bullet_pool: Optional["Pool"] = None
+        self.enemy_pool: Optional["Pool"] = None
+
+        # Length of a tick relative to a 1/TARGET_TICKS_PER_SECOND tick. It's
+        # applied to every calculation in the game that does something as a
+        # function of time. With a fixed timestep it's always 1, but keeping it
+        # around allows running the simulation at coarser timesteps.
+        self.delta_time: float = 1
+
+        # Game time, advanced by advance() at the end of every tick. Game logic
+        # reads time from here rather than from SDL's clock, so how a game
+        # plays out depends only on its inputs. That's what makes recording
+        # and replaying a game possible.
+        self.tick = 0
+        self.time_ms = 0.0
+
+        # Actions held during the current tick. Set by controls.apply() at the
+        # start of every tick from whatever input source drives the game, such
+        # as the keyboard or a recording.
+        self.input = Input()
+
+        # Structural changes made while systems run, applied at sync points.
+        self.commands = CommandBuffer(self)
+
+        # Every entity created for the world, in order of creation, whether in
+        # play or not. An entity's position in the list, its serial, identifies
+        # it in snapshots.
+        self.owned: List["entities.Entity"] = []
+
+    def advance(self) -> None:
+        self.tick += 1
+        self.time_ms += config.TICK_MS * self.delta_time
+
+    def add(self, entity: "entities.Entity") -> None:
+        self.entities[entity] = None
+        for component_type, component in entity.components.items():
+            self.component_added(entity, component_type)
+            component.added()
+
+    def remove(self, entity: "entities.Entity") -> None:
+        for component_type, component in entity.components.items():
+            self.component_removed(entity, component_type)
+            component.removed()
+        del self.entities[entity]
+
+    def component_added(self, entity: "entities.Entity",
+                        component_type: ComponentType) -> None:
+        self.index.setdefault(component_type, {})[entity] = None
+
+    def component_removed(self, entity: "entities.Entity",
+                          component_type: ComponentType) -> None:
+        del self.index[component_type][entity]
+
+    def clear(self) -> None:
+        for entity in self.entities:
+            for component in entity.components.values():
+                component.removed()
+        self.entities.clear()
+        self.index.clear()
+
+    def query(self, *component_types: ComponentType) -> Iterator["entities.Entity"]:
+        """Yields active entities having a component of every type given. For
+        instance, world.query(Animator, VulnerableToBullets). Entities firing
+        bullets or leaving the screen while iterating only do so through
+        commands, which aren't flushed until iteration is done, so the index
+        is iterated in place."""
+        if len(component_types) == 1:
+            # By far the most common query, so skip intersecting indices.
+            for entity in self.index.get(component_types[0], ()):
+                if entity.active:
+                    yield entity
+            return
+
+        candidates = [self.index.get(t, {}) for t in component_types]
+        smallest = min(candidates, key=len)
+        others = [c for c in candidates if c is not smallest]
+        for entity in smallest:
+            if entity.active and all(entity in other for other in others):
+                yield entity